@@ -0,0 +1,306 @@
+# Load test for the API. Starts `main.app` in process (lifespan included) against a local
+# mongod or the in-memory engine in memorydb.py, seeds it, then drives every scenario below
+# with N concurrent clients and reports throughput and p50/p95/p99 latency.
+#
+#   python benchmarks/load.py --backend memory --output results.json
+#   python benchmarks/load.py --backend mongo --mongo-uri mongodb://localhost:27017
+#   python benchmarks/load.py --backend memory --compare benchmarks/baselines/memory.json
+#
+# With --compare the run exits with status 1 when a route's p95 grew, or its throughput
+# dropped, by more than --tolerance against the baseline file.
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import main  # noqa: E402
+
+JPEG = bytes.fromhex(
+    "ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c1912130f"
+    "141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b08000100010101"
+    "1100ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400b5100002010303020403050504"
+    "040000017d01020300041105122131410613516107227114328191a1082342b1c11552d1f02433627282090a161718191a25"
+    "262728292a3435363738393a434445464748494a535455565758595a636465666768696a737475767778797a838485868788"
+    "898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3"
+    "e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fbd3ffd9"
+)
+
+
+# ---- seeding ----
+
+async def seed(db, args) -> dict:
+    rng = random.Random(args.seed)
+    states = [{"_id": ObjectId(), "state_name": f"State {i}"} for i in range(args.states)]
+    districts = [
+        {"_id": ObjectId(), "district_name": f"District {i}", "state_id": str(rng.choice(states)["_id"])}
+        for i in range(args.states * 10)
+    ]
+    places = [
+        {"_id": ObjectId(), "place_name": f"Place {i}", "district_id": str(rng.choice(districts)["_id"])}
+        for i in range(args.states * 100)
+    ]
+    users = [
+        {
+            "_id": ObjectId(),
+            "user_email": f"user{i}@example.com",
+            "user_password": f"password{i}",
+            "user_name": f"User {i}",
+            "user_phone": str(9000000000 + i),
+            "user_address": f"{i} Beach Road",
+            "place_id": str(rng.choice(places)["_id"]),
+        }
+        for i in range(args.users)
+    ]
+    hotels = [
+        {
+            "_id": ObjectId(),
+            "hotel_name": f"Hotel {i}",
+            "hotel_email": f"hotel{i}@example.com",
+            "hotel_password": f"hotel{i}",
+            "hotel_address": f"{i} Hill Street",
+            "place_id": str(rng.choice(places)["_id"]),
+            "hotel_status": rng.choice(["pending", "approved", "approved", "approved"]),
+            "hotel_room_count": rng.randint(5, 60),
+            "hotel_photo": "http://127.0.0.1:8000/uploads/hotel.jpg",
+        }
+        for i in range(args.hotels)
+    ]
+    packages = [
+        {
+            "_id": ObjectId(),
+            "hotel_id": str(rng.choice(hotels)["_id"]),
+            "package_name": f"{rng.choice(['Munnar', 'Alleppey', 'Wayanad', 'Kovalam', 'Thekkady'])} getaway {i}",
+            "package_description": "Houseboat cruise, tea gardens, spice plantation walk and all meals included.",
+            "package_duration": f"{(days := rng.randint(2, 7))} days",
+            "package_days": days,
+            "package_price": rng.randrange(2000, 60000, 250),
+            "package_image": "http://127.0.0.1:8000/uploads/package.jpg",
+        }
+        for i in range(args.packages)
+    ]
+    bookings = [
+        {
+            "_id": ObjectId(),
+            "booking_date": "2026-01-01",
+            "booking_for_date": "2026-02-01",
+            "booking_to_date": "2026-02-04",
+            "booking_status": "booked",
+            "packagehead_id": str(ObjectId()),
+            "user_id": str(rng.choice(users)["_id"]),
+            "guide_id": str(ObjectId()),
+            "booking_amount": rng.randrange(2000, 60000, 250),
+        }
+        for _ in range(args.bookings)
+    ]
+    cotravellers = [
+        {"_id": ObjectId(), "user_id": str(rng.choice(users)["_id"]), "cotraveller_name": f"Traveller {i}",
+         "cotraveller_number": str(8000000000 + i)}
+        for i in range(args.users * 2)
+    ]
+    for name, docs in (("state", states), ("district", districts), ("place", places), ("user", users),
+                       ("hotel", hotels), ("package", packages), ("booking", bookings), ("cotraveller", cotravellers)):
+        for start in range(0, len(docs), 1000):
+            await db[name].insert_many(docs[start:start + 1000])
+    await main.rebuild_package_view(db)
+    main.lookup_cache.invalidate("state")
+    main.lookup_cache.invalidate("district")
+    main.lookup_cache.invalidate("place")
+    return {"states": states, "districts": districts, "places": places, "users": users,
+            "hotels": hotels, "packages": packages}
+
+
+# ---- scenarios ----
+
+# Each scenario returns the arguments of one request; they are drawn from the seeded data
+def scenarios(data: dict, rng: random.Random) -> dict:
+    def user():
+        return rng.choice(data["users"])
+
+    def hotel():
+        return rng.choice(data["hotels"])
+
+    def form_booking():
+        chosen = hotel()
+        start = 1 + rng.randrange(300)
+        return ("POST", "/booking/", {"json": {
+            "booking_date": "2026-01-01",
+            "booking_for_date": f"2027-{1 + start // 28 % 12:02d}-{1 + start % 28:02d}",
+            "booking_to_date": f"2027-{1 + start // 28 % 12:02d}-{1 + start % 28:02d}",
+            "booking_status": "booked",
+            "packagehead_id": str(ObjectId()),
+            "user_id": str(user()["_id"]),
+            "guide_id": str(ObjectId()),
+            "booking_amount": 9999,
+            "hotel_id": str(chosen["_id"]),
+        }})
+
+    return {
+        "login": lambda: ("POST", "/login", {"json": {
+            "user_email": (u := user())["user_email"], "user_password": u["user_password"]}}),
+        "userdetails": lambda: ("GET", f"/userdetails/{user()['_id']}", {}),
+        "username": lambda: ("GET", f"/username/{user()['_id']}", {}),
+        "state": lambda: ("GET", "/state", {}),
+        "district_by_state": lambda: ("GET", f"/district/{rng.choice(data['states'])['_id']}", {}),
+        "place_by_district": lambda: ("GET", f"/place/{rng.choice(data['districts'])['_id']}", {}),
+        "packagelist": lambda: ("GET", "/packagelist/", {}),
+        "packages_by_hotel": lambda: ("GET", f"/packages/{hotel()['_id']}", {}),
+        "package_search": lambda: ("GET", "/packages/search", {"params": {
+            "q": rng.choice(["munnar", "alleppey houseboat", "tea"]), "max_price": 30000}}),
+        "hoteldetails": lambda: ("GET", f"/hoteldetails/{hotel()['_id']}", {}),
+        "pending": lambda: ("GET", "/pending", {}),
+        "cotravellers": lambda: ("GET", f"/cotravellerslist/{user()['_id']}", {}),
+        "booking": form_booking,
+        "rating": lambda: ("POST", "/rating/", {"json": {
+            "user_id": str(user()["_id"]), "guide_id": str(ObjectId()), "hotel_id": str(hotel()["_id"]),
+            "rating_contact": 1, "rating_count": rng.randint(1, 5)}}),
+        "upload": lambda: ("POST", "/fileUp/", {"files": {
+            "photo": (f"photo{rng.randrange(50)}.jpg", io.BytesIO(JPEG + os.urandom(8) * rng.randrange(2)), "image/jpeg")}}),
+        "profile_photo": lambda: ("POST", f"/updateprofile/{user()['_id']}", {"files": {
+            "profileImage": ("me.jpg", io.BytesIO(JPEG), "image/jpeg")}}),
+    }
+
+
+# ---- driver ----
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def drive(client: httpx.AsyncClient, make_request, total: int, concurrency: int) -> dict:
+    latencies, errors, statuses = [], 0, {}
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = make_request()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = response.status_code
+            except Exception:
+                status = "exception"
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == "exception" or status >= 500:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "statuses": statuses,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def run(args) -> dict:
+    main.STORAGE_BACKEND = args.backend
+    main.RATE_LIMITS.clear()  # Every simulated client shares one address; measure the routes, not the limiter
+    main.MONGO_URI = args.mongo_uri
+    main.DATABASE_NAME = args.database
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    main.UPLOAD_DIR = os.path.join(workdir, "uploads")
+    main.thumbnail_cache.directory = os.path.join(workdir, "thumbnails")
+
+    async with main.app.router.lifespan_context(main.app):
+        db = main.app.state.db
+        if args.backend == "mongo":
+            await db.client.drop_database(args.database)
+            await main.ensure_indexes(db)
+        data = await seed(db, args)
+        rng = random.Random(args.seed)
+        transport = httpx.ASGITransport(app=main.app)
+        results = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, make_request in scenarios(data, rng).items():
+                if args.routes and name not in args.routes:
+                    continue
+                await drive(client, make_request, min(args.warmup, args.requests), args.concurrency)
+                results[name] = await drive(client, make_request, args.requests, args.concurrency)
+                print(f"{name:<20} {results[name]['throughput_rps']:>9.1f} req/s  "
+                      f"p50 {results[name]['p50_ms']:>8.2f} ms  p95 {results[name]['p95_ms']:>8.2f} ms  "
+                      f"p99 {results[name]['p99_ms']:>8.2f} ms  errors {results[name]['errors']}")
+        if args.backend == "mongo":
+            await db.client.drop_database(args.database)
+
+    return {
+        "meta": {
+            "backend": args.backend,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "seed": {key: getattr(args, key) for key in ("states", "users", "hotels", "packages", "bookings")},
+        },
+        "routes": results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, current in results["routes"].items():
+        previous = baseline["routes"].get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", choices=["memory", "mongo"], default="memory")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="db_jetsetgo_bench", help="dropped before and after the run")
+    parser.add_argument("--states", type=int, default=10)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--hotels", type=int, default=200)
+    parser.add_argument("--packages", type=int, default=2000)
+    parser.add_argument("--bookings", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--routes", nargs="*", help="only run these scenarios")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+    if args.compare:
+        with open(args.compare) as in_file:
+            regressions = compare(results, json.load(in_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,63 @@
+# Compares the old list-endpoint serialization (str(_id) loop + jsonable_encoder +
+# JSONResponse) with MongoJSONResponse on /packagelist/ sized payloads.
+#
+#   python benchmarks/serialization.py
+import copy
+import os
+import sys
+import timeit
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from main import MongoJSONResponse, PAGE_SIZE, MAX_PAGE_SIZE  # noqa: E402
+
+
+def make_packages(count: int) -> list:
+    return [
+        {
+            "_id": ObjectId(),
+            "hotel_id": str(ObjectId()),
+            "package_name": f"Munnar hill escape {i}",
+            "package_description": "Three nights in the hills with tea estate walks, a boat ride and all meals. " * 3,
+            "package_duration": str(2 + i % 6),
+            "package_price": str(4999 + 250 * (i % 20)),
+            "package_image": f"http://127.0.0.1:8000/uploads/{ObjectId()}.jpg",
+        }
+        for i in range(count)
+    ]
+
+
+def old_path(packages: list) -> bytes:
+    for package in packages:
+        package["_id"] = str(package["_id"])
+    return JSONResponse(jsonable_encoder(packages)).body
+
+
+def new_path(packages: list) -> bytes:
+    return MongoJSONResponse(packages).body
+
+
+def run(count: int, repeat: int = 5, number: int = 200) -> dict:
+    packages = make_packages(count)
+    results = {}
+    for name, render in (("jsonable_encoder + JSONResponse", old_path), ("MongoJSONResponse", new_path)):
+        best = None
+        for _ in range(repeat):
+            # Every call gets its own copy, like every request gets fresh documents from Mongo
+            copies = [copy.deepcopy(packages) for _ in range(number)]
+            seconds = timeit.timeit(lambda: render(copies.pop()), number=number) / number
+            best = seconds if best is None else min(best, seconds)
+        results[name] = best
+    return results
+
+
+if __name__ == "__main__":
+    for count in (PAGE_SIZE, MAX_PAGE_SIZE):
+        results = run(count)
+        baseline = results["jsonable_encoder + JSONResponse"]
+        print(f"{count} packages")
+        for name, seconds in results.items():
+            print(f"  {name:<34} {seconds * 1e6:9.1f} us  ({baseline / seconds:4.1f}x)")
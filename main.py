@@ -1,25 +1,91 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile,Form,Request
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, File, UploadFile,Form,Request,Query,Response
+from pydantic import BaseModel, Field, ValidationError
 from motor.motor_asyncio import AsyncIOMotorClient
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import aiofiles
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from passlib.context import CryptContext 
+from starlette.datastructures import Headers, QueryParams
+from starlette.routing import Match
 import logging
 from bson import ObjectId
-
-
-
+from pymongo import ASCENDING, TEXT, IndexModel, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo import monitoring
+from collections import OrderedDict, defaultdict
+import time
+import base64
+import hashlib
+import re
+import uuid
+import asyncio
+import stat
+import bisect
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import json
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it /uploads only serves the originals
+    Image = None
+
+
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DATABASE_NAME = "db_jetsetgo"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")  # "mongo", or "memory" for demos, tests and benchmarks
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxConnecting": int(os.getenv("MONGO_MAX_CONNECTING", "2")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),  # Give up waiting for a pooled connection
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+}
 
 
-logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "ERROR").upper(), format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 
 UPLOAD_DIR = "uploads"  # Directory to save uploaded files
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes read per await while saving an upload
+
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "thumbnails")  # On-disk cache of resized uploads
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_BYTES", 512 * 1024 * 1024))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+THUMBNAIL_WIDTHS = (160, 320, 640, 1280)  # ?w= is rounded up to one of these
+THUMBNAIL_PRESETS = (320, 640)  # Generated right after an image is uploaded
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 100))  # Default page size for list endpoints
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 500))
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", 5000))  # Largest array accepted by the /bulk endpoints
+MAX_GROUP_TRAVELLERS = int(os.getenv("MAX_GROUP_TRAVELLERS", 50))
+MAX_BOOKING_NIGHTS = int(os.getenv("MAX_BOOKING_NIGHTS", 90))
+STATS_DAYS = int(os.getenv("STATS_DAYS", 30))  # Days of daily counters returned by /admin/stats
+COMPLAINT_CLOSED_STATUSES = ("closed", "resolved")
+PRICE_BUCKETS = [0, 5000, 10000, 25000, 50000, 100000]  # Lower bounds of the search price facet
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 500))  # Documents fetched and written per chunk
+
+# Collections that can be streamed from /export/{collection}, with the fields left out
+EXPORT_COLLECTIONS = {
+    "package": None,
+    "booking": None,
+    "hotel": {"hotel_password": 0},
+    "state": None,
+    "district": None,
+    "place": None,
+}
 
 # # Password hashing setup
 # pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -34,44 +100,1622 @@ UPLOAD_DIR = "uploads"  # Directory to save uploaded files
 
 
 
-# Utility function to save the file
+# Keeps the original extension so StaticFiles can guess the content type
+def upload_extension(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+
+
+# Utility function to save the file under the SHA-256 of its content.
+# Identical uploads share one blob on disk; every upload still gets its own metadata row.
 async def save_file(file: UploadFile, upload_dir: str) -> str:
     os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    async with aiofiles.open(file_path, "wb") as out_file:
-        while content := await file.read(1024):
-            await out_file.write(content)
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(upload_dir, f".{uuid.uuid4().hex}.part")
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out_file:
+            while content := await file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(content)
+                size += len(content)
+                await out_file.write(content)
+        sha256 = digest.hexdigest()
+        file_path = os.path.join(upload_dir, sha256 + upload_extension(file.filename))
+        if os.path.exists(file_path):
+            os.remove(tmp_path)  # Blob already stored
+        else:
+            os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    await buffered_insert("upload", {
+        "sha256": sha256,
+        "path": file_path,
+        "filename": file.filename,
+        "content_type": file.content_type,
+        "size": size,
+        "uploaded_at": datetime.now(timezone.utc),
+    })
     return file_path
 
 
 
+# Resizes an image to the given width; runs in the thumbnail process pool
+def resize_image(src: str, dst: str, width: int, image_format: str) -> int:
+    with Image.open(src) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp_path = f"{dst}.{os.getpid()}.part"
+        image.save(tmp_path, image_format, quality=80)
+    os.replace(tmp_path, dst)
+    return os.path.getsize(dst)
+
+
+# Resized versions of uploaded images, kept on disk with least-recently-used eviction
+class ThumbnailCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pool = None  # ProcessPoolExecutor, started in lifespan
+        self._files = OrderedDict()  # name -> size, least recently used first
+        self._bytes = 0
+        self._pending = {}  # name -> future of a resize in progress
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".part"):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._bytes += size
+
+    async def get(self, src: str, width: int, image_format: str):
+        if self.pool is None:
+            return None
+        ext = "webp" if image_format == "WEBP" else "jpg"
+        name = f"{os.path.basename(src)}-{width}.{ext}"
+        path = os.path.join(self.directory, name)
+        if name in self._files:
+            self._files.move_to_end(name)
+            os.utime(path)
+            return path
+        future = self._pending.get(name)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, resize_image, src, path, width, image_format)
+            self._pending[name] = future
+            try:
+                size = await future
+            finally:
+                del self._pending[name]
+            self._files[name] = size
+            self._bytes += size
+            self.evict()
+        else:
+            await future
+        return path
+
+    def evict(self):
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_DIR, THUMBNAIL_CACHE_BYTES)
+# Background jobs: follow-up work such as thumbnails is recorded in the "job" collection and run
+# by a few worker tasks, so routes return as soon as the record is written. A worker claims a
+# job by leasing it; when a worker dies mid-job the lease runs out and another one picks it up,
+# so queued work survives restarts. Jobs run at least once, so handlers must be idempotent.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "5"))  # Doubled after every failed attempt
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))  # Also picks up jobs queued by other processes
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "10"))  # How long shutdown waits for due jobs
+JOB_RETENTION_SECONDS = 7 * 24 * 3600  # Finished jobs are removed by a TTL index after this
+JOB_HANDLERS = {}  # kind -> async handler(payload)
+
+
+def job_handler(kind: str):
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        return handler
+    return register
+
+
+class JobQueue:
+    def __init__(self):
+        self.db = None
+        self.workers = []
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.busy = 0
+        self.outcomes = defaultdict(int)  # (kind, outcome) -> count
+
+    async def start(self, db):
+        self.db = db
+        self.stopping = False
+        self.workers = [asyncio.create_task(self.work()) for _ in range(JOB_WORKERS)]
+
+    async def enqueue(self, kind: str, payload: dict, delay: float = 0):
+        now = datetime.now(timezone.utc)
+        result = await self.db["job"].insert_one({
+            "kind": kind,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "run_at": now + timedelta(seconds=delay),
+            "created_at": now,
+        })
+        self.wakeup.set()
+        return result.inserted_id
+
+    async def claim(self):
+        now = datetime.now(timezone.utc)
+        return await self.db["job"].find_one_and_update(
+            {"$or": [
+                {"status": "queued", "run_at": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "running", "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS)}, "$inc": {"attempts": 1}},
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def work(self):
+        while not self.stopping:
+            self.wakeup.clear()  # Cleared before claiming so an enqueue in between is not missed
+            try:
+                job = await self.claim()
+            except Exception as e:
+                logger.error(f"Could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.busy += 1
+            try:
+                await self.run(job)
+            finally:
+                self.busy -= 1
+
+    async def run(self, job: dict):
+        kind = job["kind"]
+        handler = JOB_HANDLERS.get(kind)
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler for job kind {kind!r}")
+            await handler(job["payload"])
+        except asyncio.CancelledError:
+            # Shutdown gave up waiting; put the job back for the next start
+            await self.finish(job, {"status": "queued", "attempts": job["attempts"] - 1})
+            raise
+        except Exception as e:
+            now = datetime.now(timezone.utc)
+            if handler is not None and job["attempts"] < JOB_MAX_ATTEMPTS:
+                delay = JOB_RETRY_SECONDS * 2 ** (job["attempts"] - 1)
+                logger.warning(f"Job {job['_id']} ({kind}) failed, retrying in {delay}s: {str(e)}")
+                self.outcomes[(kind, "retried")] += 1
+                await self.finish(job, {"status": "queued", "run_at": now + timedelta(seconds=delay), "error": str(e)})
+                asyncio.get_running_loop().call_later(delay, self.wakeup.set)
+            else:
+                logger.error(f"Job {job['_id']} ({kind}) failed for good: {str(e)}")
+                self.outcomes[(kind, "failed")] += 1
+                await self.finish(job, {"status": "failed", "finished_at": now, "error": str(e)})
+        else:
+            self.outcomes[(kind, "done")] += 1
+            await self.finish(job, {"status": "done", "finished_at": datetime.now(timezone.utc)})
+
+    async def finish(self, job: dict, fields: dict):
+        try:
+            await self.db["job"].update_one({"_id": job["_id"]}, {"$set": fields, "$unset": {"lease_until": ""}})
+        except Exception as e:
+            logger.error(f"Could not record the outcome of job {job['_id']}: {str(e)}")  # Runs again after the lease
+
+    async def drain(self):
+        # Lets the workers finish every job that is already due, then stops them
+        deadline = time.monotonic() + JOB_DRAIN_SECONDS
+        while time.monotonic() < deadline:
+            due = {"status": "queued", "run_at": {"$lte": datetime.now(timezone.utc)}}
+            try:
+                if not self.busy and not await self.db["job"].count_documents(due, limit=1):
+                    break
+            except Exception:
+                break
+            await asyncio.sleep(0.05)
+        self.stopping = True
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def lines(self) -> list:
+        lines = ["# TYPE jobs_running gauge", f"jobs_running {self.busy}", "# TYPE jobs_total counter"]
+        lines += [f"jobs_total{{{metric_labels(kind=kind, outcome=outcome)}}} {count}" for (kind, outcome), count in self.outcomes.items()]
+        return lines
+
+
+job_queue = JobQueue()
+
+
+# Write-behind inserts: high-volume routes hand their document to a per-collection buffer.
+# When the collection has no write in flight the document goes out at once; otherwise it
+# joins the next insert_many, which is sent when the current one finishes, after
+# WRITE_BEHIND_DELAY_MS, or at WRITE_BEHIND_MAX_DOCS documents, whichever comes first. So
+# batches grow with load instead of every request paying a round trip. By default each
+# request still waits for its own document; WRITE_BEHIND_ACK=early answers once buffered.
+WRITE_BEHIND_DELAY_MS = float(os.getenv("WRITE_BEHIND_DELAY_MS", "5"))  # 0 writes every document directly
+WRITE_BEHIND_MAX_DOCS = int(os.getenv("WRITE_BEHIND_MAX_DOCS", "500"))
+WRITE_BEHIND_ACK = os.getenv("WRITE_BEHIND_ACK", "flushed")  # "flushed" or "early"
+
+
+class WriteBuffer:
+    def __init__(self, collection: str):
+        self.collection = collection
+        self.pending = []  # (document, future) waiting for the next flush
+        self.timer = None
+        self.writes = set()  # Flushes in progress
+        self.flushes = 0
+        self.documents = 0
+        self.failures = 0
+
+    async def insert(self, document: dict, wait: bool = True):
+        document.setdefault("_id", ObjectId())
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((document, future))
+        if not self.writes or len(self.pending) >= WRITE_BEHIND_MAX_DOCS:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(WRITE_BEHIND_DELAY_MS / 1000, self.flush)
+        if wait:
+            await asyncio.shield(future)  # A client that disconnects must not cancel the batch
+        else:
+            future.add_done_callback(self.log_failure)
+        return document["_id"]
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        task = asyncio.create_task(self.write(batch))
+        self.writes.add(task)
+        task.add_done_callback(self.written)
+
+    def written(self, task):
+        self.writes.discard(task)
+        if self.pending and not self.writes:
+            self.flush()  # Whatever arrived during the write goes out as the next batch
+
+    async def write(self, batch: list):
+        failed = {}
+        try:
+            await app.state.db[self.collection].insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = HTTPException(status_code=400, detail=error.get("errmsg", "write failed"))
+        except Exception as e:
+            failed = {index: e for index in range(len(batch))}
+        self.flushes += 1
+        self.documents += len(batch) - len(failed)
+        self.failures += len(failed)
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(None)
+
+    def log_failure(self, future):
+        if future.exception() is not None:
+            logger.error(f"Buffered insert into {self.collection} failed: {str(future.exception())}")
+
+    async def close(self):
+        self.flush()
+        await asyncio.gather(*self.writes, return_exceptions=True)
+
+
+write_buffers = {}  # collection -> WriteBuffer
+
+
+# Utility function to insert one document through its collection's write-behind buffer
+async def buffered_insert(collection: str, document: dict):
+    if WRITE_BEHIND_DELAY_MS <= 0:
+        return (await app.state.db[collection].insert_one(document)).inserted_id
+    if collection not in write_buffers:
+        write_buffers[collection] = WriteBuffer(collection)
+    return await write_buffers[collection].insert(document, wait=WRITE_BEHIND_ACK != "early")
+
+
+# Utility function to write out every buffered document, e.g. on shutdown
+async def flush_write_buffers():
+    await asyncio.gather(*(buffer.close() for buffer in write_buffers.values()))
+
+
+def write_buffer_lines() -> list:
+    lines = ["# TYPE write_behind_pending_documents gauge"]
+    lines += [f"write_behind_pending_documents{{{metric_labels(collection=name)}}} {len(buffer.pending)}" for name, buffer in write_buffers.items()]
+    lines.append("# TYPE write_behind_flushes_total counter")
+    lines += [f"write_behind_flushes_total{{{metric_labels(collection=name)}}} {buffer.flushes}" for name, buffer in write_buffers.items()]
+    lines.append("# TYPE write_behind_documents_total counter")
+    lines += [f"write_behind_documents_total{{{metric_labels(collection=name)}}} {buffer.documents}" for name, buffer in write_buffers.items()]
+    lines.append("# TYPE write_behind_failures_total counter")
+    lines += [f"write_behind_failures_total{{{metric_labels(collection=name)}}} {buffer.failures}" for name, buffer in write_buffers.items()]
+    return lines
+
+
+# Creates the preset thumbnails of an uploaded image
+@job_handler("thumbnails")
+async def create_thumbnails(payload: dict):
+    if thumbnail_cache.pool is None:
+        return
+    for width in THUMBNAIL_PRESETS:
+        try:
+            await thumbnail_cache.get(payload["path"], width, "WEBP")
+        except (Image.UnidentifiedImageError, FileNotFoundError) as e:
+            logger.error(f"Could not resize {payload['path']}: {str(e)}")  # Retrying will not help
+            return
+
+
+# Utility function to queue the thumbnails of an upload; a failure here never fails the upload
+async def schedule_thumbnails(file_path: str):
+    if Image is None or upload_extension(file_path) not in IMAGE_EXTENSIONS:
+        return
+    try:
+        await job_queue.enqueue("thumbnails", {"path": file_path})
+    except Exception as e:
+        logger.error(f"Could not queue thumbnails for {file_path}: {str(e)}")
+
+
+# Serves /uploads like StaticFiles; /uploads/{name}?w=320 serves a resized copy instead
+class UploadFiles(StaticFiles):
+    async def get_response(self, path: str, scope) -> Response:
+        width = QueryParams(scope["query_string"]).get("w")
+        if not width or not width.isdigit() or upload_extension(path) not in IMAGE_EXTENSIONS:
+            return await super().get_response(path, scope)
+        full_path, stat_result = await asyncio.to_thread(self.lookup_path, path)
+        if not stat_result or not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404)
+        width = next((w for w in THUMBNAIL_WIDTHS if w >= int(width)), THUMBNAIL_WIDTHS[-1])
+        accept = Headers(scope=scope).get("accept", "")
+        image_format = "WEBP" if "image/webp" in accept else "JPEG"
+        try:
+            thumb_path = await thumbnail_cache.get(full_path, width, image_format)
+        except Exception as e:
+            logger.error(f"Could not resize {path}: {str(e)}")
+            thumb_path = None
+        if thumb_path is None:
+            return self.file_response(full_path, stat_result, scope)
+        response = self.file_response(thumb_path, os.stat(thumb_path), scope)
+        response.headers["Vary"] = "Accept"
+        return response
+
+
+
+# In-process cache for the state/district/place lookup lists.
+# Every collection has a version number that is bumped on writes; a value read
+# from Mongo is only stored if the version did not change while it was loading.
+class LookupCache:
+    def __init__(self, ttl: float = 600, max_entries: int = 2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (collection, key) -> (expires_at, version, value)
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, collection: str) -> int:
+        return self._versions.get(collection, 0)
+
+    def get(self, collection: str, key=None):
+        entry = self._entries.get((collection, key))
+        if entry is not None:
+            expires_at, version, value = entry
+            if expires_at > time.monotonic() and version == self.version(collection):
+                self._entries.move_to_end((collection, key))
+                self.hits += 1
+                return value
+            del self._entries[(collection, key)]
+        self.misses += 1
+        return None
+
+    def set(self, collection: str, key, value, version: int):
+        if version != self.version(collection):
+            return  # a write happened while this value was being loaded
+        self._entries[(collection, key)] = (time.monotonic() + self.ttl, version, value)
+        self._entries.move_to_end((collection, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, collection: str):
+        self._versions[collection] = self.version(collection) + 1
+        for entry_key in [k for k in self._entries if k[0] == collection]:
+            del self._entries[entry_key]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "versions": dict(self._versions),
+        }
+
+
+lookup_cache = LookupCache(
+    ttl=float(os.getenv("LOOKUP_CACHE_TTL", 600)),
+    max_entries=int(os.getenv("LOOKUP_CACHE_SIZE", 2048)),
+)
+
+
+# Utility function to read a lookup list (optionally filtered on one field) through the cache
+async def cached_lookup(collection: str, field: str = None, value: str = None) -> list:
+    data = lookup_cache.get(collection, value)
+    if data is not None:
+        return data
+    version = lookup_cache.version(collection)
+    query = {field: value} if field else {}
+    data = await app.state.db[collection].find(query).to_list(length=None)
+    for item in data:
+        item["_id"] = str(item["_id"])
+    lookup_cache.set(collection, value, data, version)
+    return data
+
+
+# Utility function to load all lookup lists into the cache at startup
+async def preload_lookup_cache(db):
+    for collection, field in (("state", None), ("district", "state_id"), ("place", "district_id")):
+        version = lookup_cache.version(collection)
+        data = await db[collection].find().to_list(length=None)
+        groups = {}
+        for item in data:
+            item["_id"] = str(item["_id"])
+            if field:
+                groups.setdefault(item.get(field), []).append(item)
+        if collection != "place":
+            lookup_cache.set(collection, None, data, version)
+        for key, items in groups.items():
+            lookup_cache.set(collection, key, items, version)
+
+
+
+# Version stamps for conditional GETs. The "version" collection holds one counter per name,
+# $inc'd by the handlers that change the data behind it. ETags are built from these counters,
+# so answering If-None-Match costs one _id lookup and never builds a response body. They live
+# in Mongo rather than in the process so every worker, and every restart, agrees on them.
+async def bump_version(*names: str, db=None):
+    await (db if db is not None else app.state.db)["version"].bulk_write(
+        [UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in names],
+        ordered=False,
+    )
+
+
+async def read_version(name: str) -> int:
+    doc = await app.state.db["version"].find_one({"_id": name})
+    return doc["version"] if doc else 0
+
+
+# None for a stamp that was never created, so callers can tell "no such resource" from version 0
+async def read_versions(names: list) -> list:
+    docs = await app.state.db["version"].find({"_id": {"$in": names}}).to_list(length=None)
+    versions = {doc["_id"]: doc["version"] for doc in docs}
+    return [versions.get(name) for name in names]
+
+
+# Utility function to create stamps that do not exist yet at version 0, leaving existing ones alone
+async def seed_versions(*names: str):
+    await app.state.db["version"].bulk_write(
+        [UpdateOne({"_id": name}, {"$setOnInsert": {"version": 0}}, upsert=True) for name in names],
+        ordered=False,
+    )
+
+
+# ETag for a list of stamp versions; a stamp that was never created counts as 0
+def versions_etag(versions: list) -> str:
+    return '"v' + ".".join(str(version or 0) for version in versions) + '"'
+
+
+# True when an If-None-Match header lists the ETag (weak comparison, as RFC 9110 asks for)
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+# Utility function to record a change to states, districts or places
+async def geo_changed(collection: str):
+    lookup_cache.invalidate(collection)
+    await bump_version("geo")
+
+
+# The whole state -> district -> place hierarchy, serialized once per geo version
+geo_tree_cache = {"version": None, "body": None}
+
+
+async def build_geo_tree() -> bytes:
+    db = app.state.db
+    states = await db["state"].find({}, {"state_name": 1}).to_list(length=None)
+    districts = await db["district"].find({}, {"district_name": 1, "state_id": 1}).to_list(length=None)
+    places = await db["place"].find({}, {"place_name": 1, "district_id": 1}).to_list(length=None)
+    places_by_district = defaultdict(list)
+    for place in places:
+        places_by_district[place.get("district_id")].append({"_id": place["_id"], "place_name": place.get("place_name")})
+    districts_by_state = defaultdict(list)
+    for district in districts:
+        districts_by_state[district.get("state_id")].append({
+            "_id": district["_id"],
+            "district_name": district.get("district_name"),
+            "places": places_by_district[str(district["_id"])],
+        })
+    return dump_json([
+        {"_id": state["_id"], "state_name": state.get("state_name"), "districts": districts_by_state[str(state["_id"])]}
+        for state in states
+    ])
+
+# Secondary indexes, applied at startup. create_indexes is a no-op for indexes that already exist.
+INDEXES = {
+    "user": [IndexModel([("user_email", ASCENDING)], name="user_email_1")],
+    "upload": [IndexModel([("sha256", ASCENDING)], name="sha256_1")],
+    "hotel": [
+        IndexModel([("hotel_email", ASCENDING)], name="hotel_email_1"),
+        IndexModel([("hotel_status", ASCENDING), ("_id", ASCENDING)], name="hotel_status_1__id_1"),
+        IndexModel([("place_id", ASCENDING)], name="place_id_1"),
+    ],
+    "package": [
+        IndexModel([("hotel_id", ASCENDING), ("_id", ASCENDING)], name="hotel_id_1__id_1"),
+        IndexModel(
+            [("package_name", TEXT), ("package_description", TEXT)],
+            weights={"package_name": 3, "package_description": 1},
+            name="package_text",
+        ),
+        IndexModel([("package_price", ASCENDING)], name="package_price_1"),
+        IndexModel([("package_days", ASCENDING)], name="package_days_1"),
+    ],
+    "cotraveller": [IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="user_id_1__id_1")],
+    "district": [IndexModel([("state_id", ASCENDING)], name="state_id_1")],
+    "place": [IndexModel([("district_id", ASCENDING)], name="district_id_1")],
+    "package_view": [IndexModel([("hotel_id", ASCENDING), ("_id", ASCENDING)], name="hotel_id_1__id_1")],
+    "room_night": [IndexModel([("hotel_id", ASCENDING), ("night", ASCENDING)], name="hotel_id_1_night_1")],
+    "job": [
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_1_run_at_1"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_1_lease_until_1"),
+        IndexModel([("finished_at", ASCENDING)], name="finished_at_ttl", expireAfterSeconds=JOB_RETENTION_SECONDS),
+    ],
+}
+
+# Filters the routes run, checked against the existing indexes by /admin/indexes
+QUERY_SHAPES = [
+    {"route": "POST /login", "collection": "user", "fields": ["user_email", "user_password"]},
+    {"route": "POST /login", "collection": "hotel", "fields": ["hotel_email", "hotel_password"]},
+    {"route": "GET /userdetails/{uid}", "collection": "user", "fields": ["_id"]},
+    {"route": "GET /district/{state_id}", "collection": "district", "fields": ["state_id"]},
+    {"route": "GET /place/{district_id}", "collection": "place", "fields": ["district_id"]},
+    {"route": "GET /packages/{hid}", "collection": "package_view", "fields": ["hotel_id"]},
+    {"route": "GET /cotravellerslist/{uid}", "collection": "cotraveller", "fields": ["user_id"]},
+    {"route": "GET /pending", "collection": "hotel", "fields": ["hotel_status"]},
+    {"route": "GET /hoteldetails/{hid}", "collection": "hotel", "fields": ["_id"]},
+    {"route": "GET /packages/search", "collection": "package", "fields": ["package_price", "package_days", "hotel_id"]},
+    {"route": "GET /packages/search", "collection": "hotel", "fields": ["place_id"]},
+    {"route": "GET /availability/{hotel_id}", "collection": "room_night", "fields": ["hotel_id", "night"]},
+    {"route": "job workers", "collection": "job", "fields": ["status", "run_at", "lease_until"]},
+]
+
+
+# Older packages stored the price as a string and had no numeric day count; converts them in place
+async def migrate_package_fields(db):
+    await db["package"].update_many(
+        {"package_price": {"$regex": r"^\s*\d+(\.\d+)?\s*$"}},
+        [{"$set": {"package_price": {"$let": {
+            "vars": {"price": {"$toDouble": {"$trim": {"input": "$package_price"}}}},
+            "in": {"$cond": [{"$eq": ["$$price", {"$trunc": "$$price"}]}, {"$toInt": "$$price"}, "$$price"]},
+        }}}}],
+    )
+    await db["package"].update_many(
+        {"package_days": {"$exists": False}, "package_duration": {"$type": "string"}},
+        [{"$set": {"package_days": {"$convert": {
+            "input": {"$let": {
+                "vars": {"found": {"$regexFind": {"input": "$package_duration", "regex": "[0-9]+"}}},
+                "in": "$$found.match",
+            }},
+            "to": "int",
+            "onError": None,
+            "onNull": None,
+        }}}}],
+    )
+
+
+# Number of days at the start of a duration such as "3" or "3 days 2 nights"
+def duration_days(duration: str):
+    match = re.search(r"\d+", duration or "")
+    return int(match.group()) if match else None
+
+
+# Utility function to create the registered indexes
+async def ensure_indexes(db):
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except Exception as e:
+            logger.error(f"Could not create indexes on {collection}: {str(e)}")
+
+
+# An index can serve a query shape when the shape filters on its leading key
+def index_serves_shape(index_key: list, fields: list) -> bool:
+    return bool(index_key) and index_key[0] in fields
+
+
+
+# Credentials that read routes never send back
+HIDDEN_FIELDS = {
+    "user": ("user_password",),
+    "hotel": ("hotel_password",),
+}
+
+
+# Routes name the fields they need (or the ones to leave out) and they become a Mongo
+# projection, so unused fields are neither decoded from BSON nor sent to the client.
+def projection(fields=(), hidden=()) -> dict:
+    if fields:
+        return {field: 1 for field in fields}
+    if hidden:
+        return {field: 0 for field in hidden}
+    return None
+
+
+# Utility function to read one document by id with only the given fields
+async def fetch_by_id(collection: str, doc_id: str, fields=(), hidden=()):
+    return await app.state.db[collection].find_one({"_id": ObjectId(doc_id)}, projection(fields, hidden))
+
+
+# Page cursors are the url-safe base64 of the last _id returned
+def encode_cursor(last_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(last_id.binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid page cursor")
+
+
+# Utility function for keyset pagination on _id; returns the page and the cursor of the next one
+async def find_page(collection: str, query: dict, limit: int, cursor: str = None, hidden=()) -> tuple:
+    if cursor:
+        query = {**query, "_id": {"$gt": decode_cursor(cursor)}}
+    docs = await app.state.db[collection].find(query, projection(hidden=hidden)).sort("_id", ASCENDING).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_cursor(docs[-1]["_id"])
+    return docs, None
+
+
+
+# JSON fallback for the BSON types Mongo returns
+def json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# Encodes Mongo documents to JSON bytes, with orjson when it is installed
+def dump_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+# App-wide response class. Encodes ObjectId and datetime directly, so handlers can return
+# Mongo documents as they are; returning it from a handler also skips jsonable_encoder.
+class MongoJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+
+# Sends a page of documents, with X-Next-Cursor when there are more rows
+def page_response(docs: list, next_cursor: str = None) -> MongoJSONResponse:
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return MongoJSONResponse(docs, headers=headers)
+
+
+# Streams a cursor as newline-delimited JSON, one chunk per fetched batch
+async def stream_ndjson(cursor):
+    lines = []
+    async for doc in cursor:
+        lines.append(dump_json(doc))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+
+# Utility function for the /bulk endpoints: validates every item with the model and writes
+# the valid ones with one unordered insert_many. inserted_ids lines up with the input array.
+async def bulk_insert(collection: str, model, items: list) -> dict:
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    docs, positions, errors = [], [], []
+    for index, item in enumerate(items):
+        try:
+            docs.append(model.model_validate(item).model_dump())
+            positions.append(index)
+        except ValidationError as e:
+            errors.append({"index": index, "error": e.errors(include_url=False, include_context=False)})
+    failed = set()
+    if docs:
+        try:
+            await app.state.db[collection].insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details["writeErrors"]:
+                failed.add(write_error["index"])
+                errors.append({"index": positions[write_error["index"]], "error": write_error["errmsg"]})
+    inserted_ids = [None] * len(items)
+    for doc_index, doc in enumerate(docs):
+        if doc_index not in failed:
+            inserted_ids[positions[doc_index]] = str(doc["_id"])
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "inserted_ids": inserted_ids,
+        "errors": errors,
+        "message": f"{len(docs) - len(failed)} of {len(items)} {collection} items added",
+    }
+
+
+
+# Room availability. Every booked night of a hotel is one room_night document
+# ({hotel_id}:{YYYY-MM-DD}) holding the number of rooms taken that night.
+
+# Nights covered by a stay; the checkout day is not a night. A same-day stay counts as one night.
+def stay_nights(for_date: str, to_date: str) -> list:
+    try:
+        start, end = date.fromisoformat(for_date), date.fromisoformat(to_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="booking_to_date is before booking_for_date")
+    count = max((end - start).days, 1)
+    if count > MAX_BOOKING_NIGHTS:
+        raise HTTPException(status_code=400, detail=f"Stays are limited to {MAX_BOOKING_NIGHTS} nights")
+    return [(start + timedelta(days=offset)).isoformat() for offset in range(count)]
+
+
+# Utility function to read how many rooms a hotel has; None when the hotel never set a room count
+async def hotel_capacity(hotel_id: str):
+    try:
+        hotel = await fetch_by_id("hotel", hotel_id, fields=("hotel_room_count",))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid hotel id")
+    if not hotel:
+        raise HTTPException(status_code=404, detail="hotel not found")
+    try:
+        return int(hotel["hotel_room_count"])
+    except (KeyError, TypeError, ValueError):
+        return None  # Missing (e.g. registered through /hotelreg), empty or not a number
+
+
+async def release_rooms(hotel_id: str, nights: list, rooms: int):
+    for night in nights:
+        await app.state.db["room_night"].update_one({"_id": f"{hotel_id}:{night}"}, {"$inc": {"booked": -rooms}})
+
+
+# Takes rooms for every night of a stay, or none of them. Each night is a conditional $inc,
+# so concurrent bookings can never push a night past the hotel's capacity.
+async def reserve_rooms(hotel_id: str, nights: list, rooms: int) -> list:
+    # Returns the nights held. Hotels without a room count have no inventory to hold against,
+    # so their bookings go through untracked instead of being refused as full.
+    capacity = await hotel_capacity(hotel_id)
+    if capacity is None:
+        return []
+    if rooms > capacity:
+        raise HTTPException(status_code=409, detail="Not enough rooms available")
+    reserved = []
+    for night in nights:
+        available = {"_id": f"{hotel_id}:{night}", "booked": {"$lte": capacity - rooms}}
+        try:
+            try:
+                await app.state.db["room_night"].update_one(
+                    available,
+                    {"$inc": {"booked": rooms}, "$setOnInsert": {"hotel_id": hotel_id, "night": night}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # The night exists: either it has fewer than `rooms` left, or a concurrent booking
+                # inserted it between our match and our insert. The server does not retry upserts
+                # with a range filter, so take the rooms with a plain conditional $inc instead.
+                result = await app.state.db["room_night"].update_one(available, {"$inc": {"booked": rooms}})
+                if result.matched_count == 0:
+                    raise HTTPException(status_code=409, detail=f"Not enough rooms available on {night}")
+        except Exception:
+            await release_rooms(hotel_id, reserved, rooms)
+            raise
+        reserved.append(night)
+    return reserved
+
+
+# Rating summaries. One rating_summary document per guide and per hotel ("guide:<id>" / "hotel:<id>")
+# holds count, sum and a histogram of rating_count, kept current with $inc on every new rating.
+RATING_SUBJECTS = ("guide", "hotel")
+
+
+def rating_summary_view(summary: dict) -> dict:
+    count = summary.get("count", 0)
+    return {
+        "subject": summary["subject"],
+        "subject_id": summary["subject_id"],
+        "count": count,
+        "sum": summary.get("sum", 0),
+        "mean": summary.get("sum", 0) / count if count else None,
+        "histogram": summary.get("histogram", {}),
+    }
+
+
+# Utility function to add one rating to the guide and hotel summaries in a single round trip
+async def add_to_rating_summaries(rating: dict):
+    updates = [
+        UpdateOne(
+            {"_id": f"{subject}:{rating[f'{subject}_id']}"},
+            {
+                "$inc": {"count": 1, "sum": rating["rating_count"], f"histogram.{rating['rating_count']}": 1},
+                "$setOnInsert": {"subject": subject, "subject_id": rating[f"{subject}_id"]},
+            },
+            upsert=True,
+        )
+        for subject in RATING_SUBJECTS
+        if rating.get(f"{subject}_id")
+    ]
+    if updates:
+        await app.state.db["rating_summary"].bulk_write(updates, ordered=False)
+
+
+# Recomputes every summary from the raw rating rows, e.g. after a backfill
+async def rebuild_rating_summaries(db) -> int:
+    summaries = {}
+    for subject in RATING_SUBJECTS:
+        groups = await db["rating"].aggregate([
+            {"$match": {f"{subject}_id": {"$nin": [None, ""]}}},
+            {"$group": {"_id": {"id": f"${subject}_id", "score": "$rating_count"}, "count": {"$sum": 1}}},
+        ]).to_list(length=None)
+        for group in groups:
+            subject_id, score = group["_id"]["id"], group["_id"]["score"]
+            summary = summaries.setdefault(f"{subject}:{subject_id}", {
+                "subject": subject, "subject_id": subject_id, "count": 0, "sum": 0, "histogram": {},
+            })
+            summary["count"] += group["count"]
+            summary["sum"] += score * group["count"]
+            summary["histogram"][str(score)] = group["count"]
+    if summaries:
+        await db["rating_summary"].bulk_write(
+            [ReplaceOne({"_id": key}, summary, upsert=True) for key, summary in summaries.items()],
+            ordered=False,
+        )
+    await db["rating_summary"].delete_many({"_id": {"$nin": list(summaries)}})
+    return len(summaries)
+
+
+
+# Package read model. "package_view" has one document per package (same _id) holding the
+# package fields plus what a package card shows about its hotel, so /packagelist/ and
+# /packages/{hid} render complete cards from one indexed query. add_package, /deletepkg,
+# /updatehotel and /status keep it current; rebuild_package_view() recreates it.
+PACKAGE_CARD_HOTEL_FIELDS = ("hotel_name", "hotel_photo", "hotel_status", "place_id")
+
+
+def object_id_or_none(value):
+    return ObjectId(value) if isinstance(value, str) and ObjectId.is_valid(value) else None
+
+
+# The hotel part of a package card; places and districts map _id -> document
+def hotel_card(hotel: dict, places: dict, districts: dict) -> dict:
+    place = places.get(object_id_or_none(hotel.get("place_id"))) or {}
+    district = districts.get(object_id_or_none(place.get("district_id"))) or {}
+    card = {field: hotel.get(field) for field in PACKAGE_CARD_HOTEL_FIELDS}
+    card["place_name"] = place.get("place_name")
+    card["district_name"] = district.get("district_name")
+    return card
+
+
+# Utility function to read the card fields of one hotel
+async def load_hotel_card(hotel_id: str) -> dict:
+    db = app.state.db
+    hotel = await db["hotel"].find_one({"_id": object_id_or_none(hotel_id)}, projection(PACKAGE_CARD_HOTEL_FIELDS)) or {}
+    place = await db["place"].find_one({"_id": object_id_or_none(hotel.get("place_id"))}) or {}
+    district = await db["district"].find_one({"_id": object_id_or_none(place.get("district_id"))}) or {}
+    return hotel_card(hotel, {place.get("_id"): place}, {district.get("_id"): district})
+
+
+# Utility function to (re)write the package_view document of a package
+async def refresh_package_card(package: dict):
+    try:
+        card = {**package, **await load_hotel_card(package.get("hotel_id"))}
+        await app.state.db["package_view"].replace_one({"_id": package["_id"]}, card, upsert=True)
+    except Exception as e:
+        logger.error(f"Could not update package_view for {package.get('_id')}: {str(e)}")
+
+
+# Utility function to copy changed hotel fields onto the cards of all its packages
+async def update_package_cards(hotel_id: str, fields: dict):
+    try:
+        await app.state.db["package_view"].update_many({"hotel_id": hotel_id}, {"$set": fields})
+    except Exception as e:
+        logger.error(f"Could not update package_view for hotel {hotel_id}: {str(e)}")
+
+
+async def rebuild_package_view(db) -> int:
+    places = {place["_id"]: place for place in await db["place"].find({}, {"place_name": 1, "district_id": 1}).to_list(length=None)}
+    districts = {district["_id"]: district for district in await db["district"].find({}, {"district_name": 1}).to_list(length=None)}
+    cards = {
+        str(hotel["_id"]): hotel_card(hotel, places, districts)
+        for hotel in await db["hotel"].find({}, projection(PACKAGE_CARD_HOTEL_FIELDS)).to_list(length=None)
+    }
+    missing = hotel_card({}, places, districts)
+    ids, batch = [], []
+    async for package in db["package"].find().batch_size(EXPORT_BATCH_SIZE):
+        ids.append(package["_id"])
+        batch.append(ReplaceOne({"_id": package["_id"]}, {**package, **cards.get(package.get("hotel_id"), missing)}, upsert=True))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            await db["package_view"].bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db["package_view"].bulk_write(batch, ordered=False)
+    await db["package_view"].delete_many({"_id": {"$nin": ids}})
+    await bump_version("package_view", *(f"packages:{hotel_id}" for hotel_id in cards), db=db)
+    return len(ids)
+
+
+
+# Admin dashboard counters. The "stats" collection has one "totals" document and one
+# "day:YYYY-MM-DD" document per UTC day; write routes $inc them as they go.
+def stats_day_key(day: date = None) -> str:
+    return f"day:{(day or datetime.now(timezone.utc).date()).isoformat()}"
+
+
+# Utility function to add to the running totals and to today's counters in one round trip
+async def bump_stats(totals: dict, daily: dict = None):
+    updates = [UpdateOne({"_id": "totals"}, {"$inc": totals}, upsert=True)]
+    if daily:
+        updates.append(UpdateOne({"_id": stats_day_key()}, {"$inc": daily}, upsert=True))
+    try:
+        await app.state.db["stats"].bulk_write(updates, ordered=False)
+    except Exception as e:
+        # Counters must never fail the write they describe; rebuild-stats repairs them
+        logger.error(f"Could not update stats: {str(e)}")
+
+
+async def count_hotel_status_change(previous: str, current: str):
+    if previous == current:
+        return
+    change = {}
+    if previous == "pending":
+        change["pending_hotels"] = -1
+    if current == "pending":
+        change["pending_hotels"] = 1
+    if change:
+        await bump_stats(change)
+
+
+def complaint_is_open(status: str) -> bool:
+    return (status or "").lower() not in COMPLAINT_CLOSED_STATUSES
+
+
+# Recomputes all counters from the collections. Daily counters use the creation time in each _id.
+async def rebuild_stats(db) -> dict:
+    per_day = {"$group": {
+        "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": "$_id"}}},
+        "count": {"$sum": 1},
+    }}
+    totals = {
+        "hotels": await db["hotel"].count_documents({}),
+        "pending_hotels": await db["hotel"].count_documents({"hotel_status": "pending"}),
+        "bookings": await db["booking"].count_documents({}),
+        "users": await db["user"].count_documents({}),
+        "complaints": await db["complaint"].count_documents({}),
+        "open_complaints": await db["complaint"].count_documents({
+            "complaint_status": {"$not": re.compile(f"^({'|'.join(COMPLAINT_CLOSED_STATUSES)})$", re.IGNORECASE)},
+        }),
+    }
+    days = {}
+    for collection, counter in (("hotel", "hotels"), ("booking", "bookings"), ("user", "users"), ("complaint", "complaints")):
+        for group in await db[collection].aggregate([per_day]).to_list(length=None):
+            days.setdefault(f"day:{group['_id']}", {})[counter] = group["count"]
+    await db["stats"].delete_many({})
+    await db["stats"].insert_many([{"_id": "totals", **totals}, *({"_id": key, **counts} for key, counts in days.items())])
+    return totals
+
+
+
+# Metrics for /metrics: request latency per route, status codes, requests in flight and
+# Mongo command latency per collection, rendered in the Prometheus text format.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+
+    def lines(self, name: str, labels: str) -> list:
+        lines, total = [], 0
+        for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {total}")
+        return lines
+
+
+def metric_labels(**labels) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+
+
+class Metrics:
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = defaultdict(Histogram)  # (method, route) -> latency
+        self.responses = defaultdict(int)  # (method, route, status) -> count
+        self.commands = defaultdict(Histogram)  # (collection, command) -> latency
+        self.command_failures = defaultdict(int)  # (collection, command) -> count
+        self.lock = threading.Lock()  # Command events arrive on the driver's threads
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self.requests[(method, route)].observe(seconds)
+        self.responses[(method, route, status)] += 1
+
+    def observe_command(self, collection: str, command: str, seconds: float, failed: bool = False):
+        with self.lock:
+            self.commands[(collection, command)].observe(seconds)
+            if failed:
+                self.command_failures[(collection, command)] += 1
+
+    def render(self) -> str:
+        lines = [
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in list(self.requests.items()):
+            lines += histogram.lines("http_request_duration_seconds", metric_labels(method=method, route=route))
+        lines.append("# TYPE http_responses_total counter")
+        for (method, route, status), count in list(self.responses.items()):
+            lines.append(f"http_responses_total{{{metric_labels(method=method, route=route, status=status)}}} {count}")
+        with self.lock:
+            lines.append("# TYPE mongodb_command_duration_seconds histogram")
+            for (collection, command), histogram in self.commands.items():
+                labels = metric_labels(collection=collection, command=command)
+                lines += histogram.lines("mongodb_command_duration_seconds", labels)
+            lines.append("# TYPE mongodb_command_failures_total counter")
+            for (collection, command), count in self.command_failures.items():
+                lines.append(f"mongodb_command_failures_total{{{metric_labels(collection=collection, command=command)}}} {count}")
+        lines += pool_metrics.lines()
+        lines += admission_lines()
+        lines += rate_limit_lines()
+        lines += job_queue.lines()
+        lines += write_buffer_lines()
+        lines += conditional_get_lines()
+        lines += [
+            "# TYPE lookup_cache_hits_total counter",
+            f"lookup_cache_hits_total {lookup_cache.hits}",
+            "# TYPE lookup_cache_misses_total counter",
+            f"lookup_cache_misses_total {lookup_cache.misses}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Times every request; the route label is the path template, e.g. /userdetails/{uid}
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight -= 1
+            # Responses sent by a middleware before routing carry the label it put in scope
+            route = getattr(scope.get("route"), "path", None) or scope.get("route_label", "unmatched")
+            metrics.observe_request(scope["method"], route, status, time.perf_counter() - start)
+
+
+# Utility function to find the path template of a request a middleware answers itself, for metrics
+def route_template(scope) -> str:
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+# Times every Mongo command the driver sends, labelled by collection and command name
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.pending = {}  # (connection, request id) -> (collection, command)
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        self.pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def succeeded(self, event):
+        labels = self.pending.pop((event.connection_id, event.request_id), None)
+        if labels:
+            metrics.observe_command(*labels, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self.pending.pop((event.connection_id, event.request_id), None)
+        if labels:
+            metrics.observe_command(*labels, event.duration_micros / 1e6, failed=True)
+
+
+command_metrics = CommandMetrics()
+
+
+# Tracks the Motor connection pool: connections checked out, requests waiting for one and failed checkouts
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = defaultdict(int)  # reason -> count
+        self.lock = threading.Lock()
+
+    def connection_check_out_started(self, event):
+        with self.lock:
+            self.waiting += 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.waiting -= 1
+            self.checkout_failures[str(event.reason)] += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def lines(self) -> list:
+        with self.lock:
+            lines = [
+                "# TYPE mongodb_pool_checked_out_connections gauge",
+                f"mongodb_pool_checked_out_connections {self.checked_out}",
+                "# TYPE mongodb_pool_waiting_requests gauge",
+                f"mongodb_pool_waiting_requests {self.waiting}",
+                "# TYPE mongodb_pool_checkout_failures_total counter",
+            ]
+            for reason, count in self.checkout_failures.items():
+                lines.append(f"mongodb_pool_checkout_failures_total{{{metric_labels(reason=reason)}}} {count}")
+        return lines
+
+
+pool_metrics = PoolMetrics()
+
+
+# Admission control: expensive route groups get a fixed number of requests running at once
+# and a bounded queue behind them. Anything beyond the queue, or waiting longer than
+# ADMISSION_WAIT_SECONDS, gets a 503 straight away so it never reaches Mongo or the disk.
+# Routes outside every group (login, lookups, /metrics) are not limited.
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "2"))
+ADMISSION_GROUPS = {  # group -> (requests running at once, requests allowed to wait)
+    "uploads": (int(os.getenv("UPLOAD_CONCURRENCY", "8")), int(os.getenv("UPLOAD_QUEUE", "32"))),
+    "lists": (int(os.getenv("LIST_CONCURRENCY", "16")), int(os.getenv("LIST_QUEUE", "64"))),
+    "admin": (int(os.getenv("ADMIN_CONCURRENCY", "2")), int(os.getenv("ADMIN_QUEUE", "4"))),
+}
+ADMISSION_ROUTES = [  # (method, path pattern, group); the first match wins
+    ("POST", re.compile(r"^/(fileUp/|hotelreg|updateprofile/[^/]+|editUser/[^/]+|packageadd/[^/]+)$"), "uploads"),
+    ("GET", re.compile(r"^/(packagelist/|packages/search|pending)$"), "lists"),
+    ("POST", re.compile(r"^/[a-z]+/bulk$"), "admin"),
+    ("GET", re.compile(r"^/export/[^/]+$"), "admin"),
+    ("POST", re.compile(r"^/admin/(stats|ratings|packages)/rebuild$"), "admin"),
+]
+
+
+class AdmissionGate:
+    def __init__(self, limit: int, queue: int):
+        self.limit = limit
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(limit)
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = defaultdict(int)  # reason -> count
+
+    async def enter(self) -> str:
+        # Returns None once admitted, otherwise the reason the request was shed
+        if self.semaphore.locked():
+            if self.waiting >= self.queue:
+                self.rejected["queue_full"] += 1
+                return "queue_full"
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), ADMISSION_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                self.rejected["timeout"] += 1
+                return "timeout"
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+        self.running += 1
+        self.admitted += 1
+        return None
+
+    def leave(self):
+        self.running -= 1
+        self.semaphore.release()
+
+
+admission_gates = {group: AdmissionGate(limit, queue) for group, (limit, queue) in ADMISSION_GROUPS.items()}
+
+
+def admission_lines() -> list:
+    lines = ["# TYPE admission_running_requests gauge"]
+    lines += [f"admission_running_requests{{{metric_labels(group=group)}}} {gate.running}" for group, gate in admission_gates.items()]
+    lines.append("# TYPE admission_waiting_requests gauge")
+    lines += [f"admission_waiting_requests{{{metric_labels(group=group)}}} {gate.waiting}" for group, gate in admission_gates.items()]
+    lines.append("# TYPE admission_admitted_total counter")
+    lines += [f"admission_admitted_total{{{metric_labels(group=group)}}} {gate.admitted}" for group, gate in admission_gates.items()]
+    lines.append("# TYPE admission_rejected_total counter")
+    for group, gate in admission_gates.items():
+        for reason, count in gate.rejected.items():
+            lines.append(f"admission_rejected_total{{{metric_labels(group=group, reason=reason)}}} {count}")
+    return lines
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        group = next(
+            (group for method, pattern, group in ADMISSION_ROUTES if scope["method"] == method and pattern.match(scope["path"])),
+            None,
+        )
+        if group is None:
+            return await self.app(scope, receive, send)
+        gate = admission_gates[group]
+        if await gate.enter() is not None:
+            scope["route_label"] = route_template(scope)
+            response = JSONResponse(
+                {"detail": "Server is busy, please try again shortly"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, round(ADMISSION_WAIT_SECONDS)))},
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.leave()
+
+
+
+# Token-bucket rate limits for the routes that are cheap to call and expensive to serve.
+# A policy allows `burst` requests at once and refills at `per_minute`; buckets are keyed by
+# client IP, or by the user id in the path for "user" policies. Buckets that have been idle
+# long enough to refill completely are dropped, so memory stays bounded by active clients.
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+# Proxies in front of the app that append to X-Forwarded-For; 0 keys by the socket's peer address.
+# Entries left of the ones they appended come from the client and are never trusted.
+RATE_LIMIT_TRUST_PROXY = int(os.getenv("RATE_LIMIT_TRUST_PROXY", "0"))
+RATE_LIMITS = [  # (policy, method, path pattern, key, burst, per_minute); the first match wins
+    ("login", "POST", re.compile(r"^/login$"), "ip", int(os.getenv("LOGIN_BURST", "10")), float(os.getenv("LOGIN_PER_MINUTE", "10"))),
+    ("register", "POST", re.compile(r"^/(user|hotelreg)$"), "ip", int(os.getenv("REGISTER_BURST", "5")), float(os.getenv("REGISTER_PER_MINUTE", "1"))),
+    ("password", "POST", re.compile(r"^/updatepassword/(?P<user>[^/]+)$"), "user", 5, 1),
+]
+
+
+class RateLimiter:
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self.buckets = OrderedDict()  # (policy, key) -> [tokens, last refill]; least recently used first
+        self.rejected = defaultdict(int)  # policy -> count
+
+    def allow(self, policy: str, key: str, burst: int, per_minute: float, now: float) -> float:
+        # Returns 0 when the request may go ahead, otherwise the seconds until a token is available
+        rate = per_minute / 60
+        self.evict(now)
+        bucket = self.buckets.pop((policy, key), None)
+        if bucket is None:
+            bucket = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        self.buckets[(policy, key)] = bucket
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        self.rejected[policy] += 1
+        return (1 - bucket[0]) / rate
+
+    def evict(self, now: float):
+        while len(self.buckets) >= self.max_buckets:
+            self.buckets.popitem(last=False)
+        # A bucket idle long enough to be full again behaves exactly like a new one
+        while self.buckets:
+            (policy, _), (tokens, last) = next(iter(self.buckets.items()))
+            burst, per_minute = RATE_LIMIT_POLICIES[policy]
+            if tokens + (now - last) * per_minute / 60 < burst:
+                break
+            self.buckets.popitem(last=False)
+
+
+RATE_LIMIT_POLICIES = {policy: (burst, per_minute) for policy, _, _, _, burst, per_minute in RATE_LIMITS}
+rate_limiter = RateLimiter(RATE_LIMIT_MAX_BUCKETS)
+
+
+def rate_limit_lines() -> list:
+    lines = ["# TYPE rate_limit_buckets gauge", f"rate_limit_buckets {len(rate_limiter.buckets)}", "# TYPE rate_limit_rejected_total counter"]
+    lines += [f"rate_limit_rejected_total{{{metric_labels(policy=policy)}}} {count}" for policy, count in rate_limiter.rejected.items()]
+    return lines
+
+
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        for policy, method, pattern, key_by, burst, per_minute in RATE_LIMITS:
+            match = pattern.match(scope["path"]) if scope["method"] == method else None
+            if match:
+                break
+        else:
+            return await self.app(scope, receive, send)
+        if key_by == "user":
+            key = match.group("user")
+        else:
+            forwarded = Headers(scope=scope).get("x-forwarded-for", "") if RATE_LIMIT_TRUST_PROXY else ""
+            hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+            if len(hops) >= RATE_LIMIT_TRUST_PROXY > 0:
+                key = hops[-RATE_LIMIT_TRUST_PROXY]  # The address the outermost trusted proxy saw
+            else:
+                key = (scope.get("client") or ("unknown",))[0]
+        retry_after = rate_limiter.allow(policy, key, burst, per_minute, time.monotonic())
+        if retry_after:
+            scope["route_label"] = route_template(scope)
+            response = JSONResponse(
+                {"detail": "Too many requests, please try again later"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+            )
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+
+# Conditional GETs for the screens mobile clients poll. Each route names the version stamps
+# (see bump_version) its response is built from; the ETag is made of their current values.
+# A request carrying If-None-Match is checked with one lookup in "version" before admission
+# control, the handler or any serialization runs, and a match is answered with a 304.
+# Unconditional requests touch nothing up front: ETagMiddleware reads the stamps once the
+# request is admitted, before the handler, and adds the ETag to the 200.
+# Write handlers bump the stamps.
+CONDITIONAL_ROUTES = [  # (route, path pattern, version stamps, Cache-Control)
+    ("/hoteldetails/{hid}", re.compile(r"^/hoteldetails/(?P<id>[^/]+)$"), ("hotel:{id}",), "private, no-cache"),
+    ("/packages/{hid}", re.compile(r"^/packages/(?!search$)(?P<id>[^/]+)$"), ("packages:{id}",), "public, max-age=30"),
+    ("/packagelist/", re.compile(r"^/packagelist/$"), ("package_view",), "public, max-age=30"),
+    ("/cotravellerslist/{uid}", re.compile(r"^/cotravellerslist/(?P<id>[^/]+)$"), ("cotravellers:{id}",), "private, no-cache"),
+    ("/userdetails/{uid}", re.compile(r"^/userdetails/(?P<id>[^/]+)$"), ("user:{id}", "geo"), "private, no-cache"),
+]
+
+
+not_modified_responses = defaultdict(int)  # route -> 304s sent
+
+
+def conditional_get_lines() -> list:
+    lines = ["# TYPE http_not_modified_total counter"]
+    lines += [f"http_not_modified_total{{{metric_labels(route=route)}}} {count}" for route, count in not_modified_responses.items()]
+    return lines
+
+
+class ConditionalGetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            return await self.app(scope, receive, send)
+        for route, pattern, stamps, cache_control in CONDITIONAL_ROUTES:
+            match = pattern.match(scope["path"])
+            if match:
+                break
+        else:
+            return await self.app(scope, receive, send)
+        names = [stamp.format(**match.groupdict()) for stamp in stamps]
+        scope["conditional"] = {"stamps": names, "cache_control": cache_control}
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if not if_none_match:
+            return await self.app(scope, receive, send)  # Nothing to compare yet; ETagMiddleware tags the response
+        try:
+            versions = await read_versions(names)
+        except Exception as e:
+            logger.error(f"Could not read version stamps: {str(e)}")
+            return await self.app(scope, receive, send)
+        etag = versions_etag(versions)
+        # A missing stamp may mean the resource does not exist, and "*" matches anything that
+        # does, so both go to the handler to get their 200, 400 or 404
+        if None not in versions and if_none_match.strip() != "*" and etag_matches(if_none_match, etag):
+            not_modified_responses[route] += 1
+            scope["route_label"] = route
+            response = Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+            return await response(scope, receive, send)
+        scope["conditional"]["versions"] = versions  # Already read; the 200 reuses them
+        await self.app(scope, receive, send)
+
+
+# Adds the ETag to 200s on the CONDITIONAL_ROUTES. Sits inside admission so shed requests never
+# read the stamps. The stamps are read before the handler runs: writers update the data and then
+# bump the stamp, so an ETag read first can only be older than the body, never newer.
+# Resources created before their stamp existed get it at version 0 the first time a client
+# revalidates them and gets a 200, so plain GETs never write.
+class ETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        conditional = scope.get("conditional")
+        if conditional is None:
+            return await self.app(scope, receive, send)
+        revalidating = "versions" in conditional
+        versions = conditional.get("versions")
+        if versions is None:
+            try:
+                versions = await read_versions(conditional["stamps"])
+            except Exception as e:
+                logger.error(f"Could not read version stamps: {str(e)}")
+                return await self.app(scope, receive, send)
+        etag = versions_etag(versions)
+        found = False
+
+        async def send_with_etag(message):
+            nonlocal found
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                found = True
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"etag", etag.encode()),
+                    (b"cache-control", conditional["cache_control"].encode()),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+        missing = [name for name, version in zip(conditional["stamps"], versions) if version is None]
+        if found and missing and revalidating:
+            try:
+                await seed_versions(*missing)
+            except Exception as e:
+                logger.error(f"Could not create version stamps: {str(e)}")
+
+
+# Utility function to open the configured storage backend; both expose the Motor collection API
+def open_storage():
+    if STORAGE_BACKEND == "memory":
+        from memorydb import MemoryClient
+        return MemoryClient()
+    if STORAGE_BACKEND != "mongo":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected 'mongo' or 'memory'")
+    return AsyncIOMotorClient(MONGO_URI, event_listeners=[command_metrics, pool_metrics], **MONGO_POOL_OPTIONS)
 
 
 # FastAPI app
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
-    mongo_client = AsyncIOMotorClient(MONGO_URI)
+    mongo_client = open_storage()
     db = mongo_client[DATABASE_NAME]
     app.state.db = db  # Attach the database to app.state
-    print("Connected to MongoDB")
+    print("Connected to MongoDB" if STORAGE_BACKEND == "mongo" else "Using the in-memory database")
+    await ensure_indexes(db)
+    try:
+        await migrate_package_fields(db)
+    except Exception as e:
+        logger.error(f"Could not migrate package fields: {str(e)}")
+    try:
+        if not await db["package_view"].count_documents({}, limit=1):
+            await rebuild_package_view(db)  # First start with the read model
+    except Exception as e:
+        logger.error(f"Could not build package_view: {str(e)}")
+    if Image is not None:
+        thumbnail_cache.load()
+        thumbnail_cache.pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    try:
+        await preload_lookup_cache(db)
+    except Exception as e:
+        logger.error(f"Could not preload lookup cache: {str(e)}")
+    await job_queue.start(db)
     yield
     # Shutdown logic
-    await mongo_client.close()
-    print("MongoDB connection closed")
+    await flush_write_buffers()
+    await job_queue.drain()
+    if thumbnail_cache.pool is not None:
+        thumbnail_cache.pool.shutdown(cancel_futures=True)
+        thumbnail_cache.pool = None
+    mongo_client.close()
+    print("MongoDB connection closed" if STORAGE_BACKEND == "mongo" else "In-memory database discarded")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=MongoJSONResponse)
 
 
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", UploadFiles(directory=UPLOAD_DIR), name="uploads")
 
+app.add_middleware(ETagMiddleware)  # Inside admission so shed requests never read the version stamps
+app.add_middleware(AdmissionMiddleware)  # Inside CORS so 503s still carry the CORS headers
+app.add_middleware(ConditionalGetMiddleware)  # Before admission so a 304 never waits for a slot
+app.add_middleware(RateLimitMiddleware)  # Runs before admission so rejected requests never hold a slot
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 class Admin(BaseModel):
@@ -95,18 +1739,23 @@ class State(BaseModel):
 async def create_state(state:State):
     state_data = state.model_dump()
     result = await app.state.db["state"].insert_one(state_data)
+    await geo_changed("state")
     return{"id": str(result.inserted_id),"message": "state added sucessfully"}
 
 
+@app.post("/state/bulk")
+async def create_states(items: list[dict]):
+    result = await bulk_insert("state", State, items)
+    await geo_changed("state")
+    return result
+
+
 @app.get("/state")
 async def read_state():
-    cursor = app.state.db["state"].find()
-    stateData = await cursor.to_list(length=None)  # Convert cursor to list
-    for state in stateData:
-        state["_id"] = str(state["_id"])
+    stateData = await cached_lookup("state")
     if not stateData:
         raise HTTPException(status_code=404, detail="Item not found")
-    return stateData
+    return MongoJSONResponse(stateData)
 
 
 class District(BaseModel):
@@ -117,17 +1766,22 @@ class District(BaseModel):
 async def create_district(district:District):
     district_data =district.model_dump()
     result = await app.state.db["district"].insert_one(district_data)
+    await geo_changed("district")
     return{"id": str(result.inserted_id),"message": "district added sucessfully"}
 
+
+@app.post("/district/bulk")
+async def create_districts(items: list[dict]):
+    result = await bulk_insert("district", District, items)
+    await geo_changed("district")
+    return result
+
 @app.get("/district")
 async def read_district():
-    cursor = app.state.db["district"].find()
-    districtData = await cursor.to_list(length=None)  # Convert cursor to list
-    for district in districtData:
-        district["_id"] = str(district["_id"])
+    districtData = await cached_lookup("district")
     if not districtData:
         raise HTTPException(status_code=404, detail="Item not found")
-    return districtData
+    return MongoJSONResponse(districtData)
 
 
 
@@ -139,9 +1793,69 @@ class Place(BaseModel):
 async def create_place(place:Place):
     place_data = place.model_dump()
     result = await app.state.db["place"].insert_one(place_data)
+    await geo_changed("place")
     return{"id": str(result.inserted_id),"message": "place added sucessfully"}
 
 
+@app.post("/place/bulk")
+async def create_places(items: list[dict]):
+    result = await bulk_insert("place", Place, items)
+    await geo_changed("place")
+    return result
+
+
+@app.get("/export/{collection}")
+async def export_collection(collection: str, cursor: str = None):
+    if collection not in EXPORT_COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Unknown collection")
+    if cursor and ObjectId.is_valid(cursor):
+        after = ObjectId(cursor)  # The last _id a sync received, as it appears in the stream
+    elif cursor:
+        after = decode_cursor(cursor)
+    query = {"_id": {"$gt": after}} if cursor else {}
+    docs = (
+        app.state.db[collection]
+        .find(query, EXPORT_COLLECTIONS[collection])
+        .sort("_id", ASCENDING)
+        .batch_size(EXPORT_BATCH_SIZE)
+    )
+    return StreamingResponse(stream_ndjson(docs), media_type="application/x-ndjson")
+
+
+@app.get("/admin/indexes")
+async def read_index_report():
+    collections = sorted(set(INDEXES) | {shape["collection"] for shape in QUERY_SHAPES})
+    index_keys = {}
+    report = {}
+    for collection in collections:
+        stats = await app.state.db[collection].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        index_keys[collection] = [list(stat["key"]) for stat in stats]
+        report[collection] = [
+            {
+                "name": stat["name"],
+                "key": dict(stat["key"]),
+                "ops": stat["accesses"]["ops"],
+                "since": stat["accesses"]["since"],
+            }
+            for stat in stats
+        ]
+    unindexed = [
+        shape for shape in QUERY_SHAPES
+        if not any(index_serves_shape(key, shape["fields"]) for key in index_keys[shape["collection"]])
+    ]
+    return {"indexes": report, "unindexed_queries": unindexed}
+
+
+@app.get("/metrics")
+async def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def read_cache_stats():
+    return lookup_cache.stats()
+
+
 class Hotel(BaseModel):
     hotel_name  : str
     hotel_email : str
@@ -179,6 +1893,8 @@ class User(BaseModel):
 async def create_user(user:User):
     user_data = user.model_dump()
     result = await app.state.db["user"].insert_one(user_data)
+    await bump_stats({"users": 1}, {"users": 1})
+    await bump_version(f"user:{result.inserted_id}")
     return{"id": str(result.inserted_id),"message": "user added sucessfully"}
 
 
@@ -234,6 +1950,11 @@ async def create_packagebody(packagebody:Packagebody):
     return{"id": str(result.inserted_id),"message": "packagebody added sucessfully"}
 
 
+@app.post("/packagebody/bulk")
+async def create_packagebodies(items: list[dict]):
+    return await bulk_insert("packagebody", Packagebody, items)
+
+
 class Gallery(BaseModel):
     packagebody_id : str
     gallery_file : str
@@ -248,6 +1969,11 @@ async def create_gallery(gallery:Gallery):
     return{"id": str(result.inserted_id),"message": "gallery added sucessfully"}
 
 
+@app.post("/gallery/bulk")
+async def create_galleries(items: list[dict]):
+    return await bulk_insert("gallery", Gallery, items)
+
+
 class Booking(BaseModel):
     booking_date : str
     booking_for_date : str
@@ -258,13 +1984,100 @@ class Booking(BaseModel):
     booking_status : str
     guide_id : str
     booking_amount : int
+    hotel_id : str | None = None  # Rooms are only held when the booking names a hotel
+    booking_room_count : int = Field(1, ge=1)
+
+
+class Traveller(BaseModel):
+    traveller_name : str
+    traveller_number : str
+
+
+# A whole party in one request: the travellers are embedded in the booking document, so the
+# booking and its travellers are written, and read back, together
+class GroupBooking(Booking):
+    travellers : list[Traveller] = Field(..., min_length=1, max_length=MAX_GROUP_TRAVELLERS)
+    save_cotravellers : bool = False  # Also add the travellers to the user's saved co-travellers
+
+
+# Utility function to hold the rooms for a booking and insert it; the rooms are released again if the insert fails
+async def place_booking(booking: Booking, booking_data: dict):
+    held = []
+    if booking.hotel_id:
+        nights = stay_nights(booking.booking_for_date, booking.booking_to_date)
+        held = await reserve_rooms(booking.hotel_id, nights, booking.booking_room_count)
+    try:
+        result = await app.state.db["booking"].insert_one(booking_data)
+    except Exception:
+        if held:
+            await release_rooms(booking.hotel_id, held, booking.booking_room_count)
+        raise
+    await bump_stats({"bookings": 1}, {"bookings": 1})
+    return result.inserted_id
 
 
 @app.post("/booking/")
 async def create_booking(booking:Booking):
     booking_data = booking.model_dump()
-    result = await app.state.db["booking"].insert_one(booking_data)
-    return{"id": str(result.inserted_id),"message": "booking added sucessfully"}
+    inserted_id = await place_booking(booking, booking_data)
+    return{"id": str(inserted_id),"message": "booking added sucessfully"}
+
+
+@app.post("/booking/group")
+async def create_group_booking(booking: GroupBooking):
+    booking_data = booking.model_dump(exclude={"save_cotravellers"})
+    inserted_id = await place_booking(booking, booking_data)
+    if booking.save_cotravellers:
+        # The booking is already placed, so a failure here is logged rather than returned: a 500
+        # would make the client retry and book the party twice
+        try:
+            try:
+                # Upserts keyed on the number, so travellers the user has saved before are not duplicated
+                await app.state.db["cotraveller"].bulk_write([
+                    UpdateOne(
+                        {"user_id": booking.user_id, "cotraveller_number": traveller.traveller_number},
+                        {"$setOnInsert": {"cotraveller_name": traveller.traveller_name}},
+                        upsert=True,
+                    )
+                    for traveller in booking.travellers
+                ], ordered=False)
+            finally:
+                await bump_version(f"cotravellers:{booking.user_id}")  # Some upserts may have landed anyway
+        except Exception as e:
+            logger.error(f"Could not save co-travellers for booking {inserted_id}: {str(e)}")
+    return {"id": str(inserted_id), "travellers": len(booking.travellers), "message": "booking added sucessfully"}
+
+
+@app.get("/booking/{booking_id}")
+async def read_booking(booking_id: str):
+    try:
+        booking = await fetch_by_id("booking", booking_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid booking id")
+    if not booking:
+        raise HTTPException(status_code=404, detail="booking not found")
+    return MongoJSONResponse(booking)
+
+
+@app.get("/availability/{hotel_id}")
+async def read_availability(hotel_id: str, for_date: str, to_date: str):
+    nights = stay_nights(for_date, to_date)
+    capacity = await hotel_capacity(hotel_id)
+    if capacity is None:
+        # No room count configured: availability is unknown rather than zero
+        return {"hotel_id": hotel_id, "hotel_room_count": None, "rooms_free": None, "nights": {night: None for night in nights}}
+    booked = await app.state.db["room_night"].find(
+        {"hotel_id": hotel_id, "night": {"$gte": nights[0], "$lte": nights[-1]}},
+        {"_id": 0, "night": 1, "booked": 1},
+    ).to_list(length=None)
+    booked = {item["night"]: item["booked"] for item in booked}
+    free = {night: max(capacity - booked.get(night, 0), 0) for night in nights}
+    return {
+        "hotel_id": hotel_id,
+        "hotel_room_count": capacity,
+        "rooms_free": min(free.values()),
+        "nights": free,
+    }
 
 
 class Userinfo(BaseModel):
@@ -277,8 +2090,8 @@ class Userinfo(BaseModel):
 @app.post("/userinfo/")
 async def create_userinfo(userinfo:Userinfo):
     userinfo_data = userinfo.model_dump()
-    result = await app.state.db["userinfo"].insert_one(userinfo_data)
-    return{"id": str(result.inserted_id),"message": "userinfo added sucessfully"}
+    inserted_id = await buffered_insert("userinfo", userinfo_data)
+    return{"id": str(inserted_id),"message": "userinfo added sucessfully"}
 
 
 class Rating(BaseModel):
@@ -292,8 +2105,62 @@ class Rating(BaseModel):
 @app.post("/rating/")
 async def create_rating(rating:Rating):
     rating_data = rating.model_dump()
-    result = await app.state.db["rating"].insert_one(rating_data)
-    return{"id": str(result.inserted_id),"message": "rating added sucessfully"}
+    inserted_id = await buffered_insert("rating", rating_data)
+    await add_to_rating_summaries(rating_data)
+    return{"id": str(inserted_id),"message": "rating added sucessfully"}
+
+
+@app.get("/ratings/{subject}/{subject_id}")
+async def read_rating_summary(subject: str, subject_id: str):
+    if subject not in RATING_SUBJECTS:
+        raise HTTPException(status_code=404, detail="Item not found")
+    summary = await app.state.db["rating_summary"].find_one({"_id": f"{subject}:{subject_id}"})
+    if not summary:
+        summary = {"subject": subject, "subject_id": subject_id}
+    return rating_summary_view(summary)
+
+
+@app.get("/admin/stats")
+async def read_admin_stats():
+    today = datetime.now(timezone.utc).date()
+    day_keys = [stats_day_key(today - timedelta(days=offset)) for offset in range(STATS_DAYS)]
+    docs = await app.state.db["stats"].find({"_id": {"$in": ["totals", *day_keys]}}).to_list(length=None)
+    docs = {doc.pop("_id"): doc for doc in docs}
+    return {
+        "totals": docs.get("totals", {}),
+        "days": [{"date": key[4:], **docs.get(key, {})} for key in day_keys],
+    }
+
+
+@app.post("/admin/stats/rebuild")
+async def rebuild_admin_stats():
+    return {"message": "stats rebuilt", "totals": await rebuild_stats(app.state.db)}
+
+
+@app.get("/admin/jobs")
+async def read_admin_jobs():
+    groups = await app.state.db["job"].aggregate([
+        {"$group": {"_id": {"kind": "$kind", "status": "$status"}, "count": {"$sum": 1}}},
+    ]).to_list(length=None)
+    counts = {}
+    for group in groups:
+        counts.setdefault(group["_id"]["kind"], {})[group["_id"]["status"]] = group["count"]
+    failed = await app.state.db["job"].find(
+        {"status": "failed"}, {"kind": 1, "payload": 1, "attempts": 1, "error": 1, "finished_at": 1},
+    ).sort("finished_at", -1).limit(20).to_list(length=None)
+    return MongoJSONResponse({"counts": counts, "recent_failures": failed})
+
+
+@app.post("/admin/packages/rebuild")
+async def rebuild_packages():
+    count = await rebuild_package_view(app.state.db)
+    return {"message": f"{count} package cards rebuilt"}
+
+
+@app.post("/admin/ratings/rebuild")
+async def rebuild_ratings():
+    count = await rebuild_rating_summaries(app.state.db)
+    return {"message": f"{count} rating summaries rebuilt"}
 
 
 
@@ -308,8 +2175,10 @@ class Complaint(BaseModel):
 @app.post("/complaint/")
 async def create_complaint(complaint:Complaint):
     complaint_data = complaint.model_dump()
-    result = await app.state.db["complaint"].insert_one(complaint_data)
-    return{"id": str(result.inserted_id),"message": "complaint added sucessfully"}
+    inserted_id = await buffered_insert("complaint", complaint_data)
+    open_count = 1 if complaint_is_open(complaint.complaint_status) else 0
+    await bump_stats({"complaints": 1, "open_complaints": open_count}, {"complaints": 1})
+    return{"id": str(inserted_id),"message": "complaint added sucessfully"}
 
 
 
@@ -328,10 +2197,10 @@ async def create_user(
 
         # Insert data into MongoDB
         user_data = { "photo": file_url}
-        result = await app.state.db["photoUpload"].insert_one(user_data)
+        inserted_id = await buffered_insert("photoUpload", user_data)
 
         return {
-            "id": str(result.inserted_id),
+            "id": str(inserted_id),
             "message": "User created successfully",
             "file_path": file_url,
         }
@@ -358,8 +2227,14 @@ class Login(BaseModel):
 
 @app.post('/login')
 async def read_user(user: Login):
-    userData = await app.state.db["user"].find_one({"user_email": user.user_email, "user_password": user.user_password})
-    hotelData = await app.state.db["hotel"].find_one({"hotel_email": user.user_email, "hotel_password": user.user_password})
+    userData = await app.state.db["user"].find_one(
+        {"user_email": user.user_email, "user_password": user.user_password},
+        projection(fields=("user_email",)),
+    )
+    hotelData = await app.state.db["hotel"].find_one(
+        {"hotel_email": user.user_email, "hotel_password": user.user_password},
+        projection(fields=("hotel_email", "hotel_status")),
+    )
 
     if userData:
         return { 'id': str(userData['_id']),
@@ -383,9 +2258,11 @@ async def updateuser(uid: str,
 ):
     try:
         saved_filename = await save_file(profileImage, UPLOAD_DIR)
+        await schedule_thumbnails(saved_filename)
         file_url = f"http://127.0.0.1:8000/{saved_filename}"
         user_data = { "user_photo": file_url}
         result = await app.state.db["user"].update_one({"_id": ObjectId(uid)}, {"$set": user_data})
+        await bump_version(f"user:{uid}")
         return {
           "id": str(uid),
           "message": "User created successfully",
@@ -426,6 +2303,7 @@ async def edit_user(uid: str,
         user_data = {"user_name": name,"user_address": address, "user_proof":id_url,"user_phone":phone,"place_id":place}
         # result = await app.state.db["user"].insert_one(user_data)
         result = await app.state.db["user"].update_one({"_id": ObjectId(uid)}, {"$set": user_data})
+        await bump_version(f"user:{uid}")
         
     #     return {
     #         "id": str(result.inserted_id),
@@ -450,23 +2328,25 @@ async def edit_user(uid: str,
 
 @app.get("/district/{state_id}")
 async def read_district(state_id: str):
-    cursor = app.state.db["district"].find({"state_id": state_id})   
-    DistrictData = await cursor.to_list(length=None)
-    for district in DistrictData:
-        district["_id"] = str(district["_id"])
-        if not district:
-            raise HTTPException(status_code=404, detail="Item not found")
-    return DistrictData
+    DistrictData = await cached_lookup("district", "state_id", state_id)
+    return MongoJSONResponse(DistrictData)
 
 @app.get("/place/{district_id}")
 async def read_place(district_id: str):
-    cursor = app.state.db["place"].find({"district_id": district_id})   
-    PlaceData = await cursor.to_list(length=None)
-    for place in PlaceData:
-        place["_id"] = str(place["_id"])
-        if not place:
-            raise HTTPException(status_code=404, detail="Item not found")
-    return PlaceData
+    PlaceData = await cached_lookup("place", "district_id", district_id)
+    return MongoJSONResponse(PlaceData)
+
+
+@app.get("/geo/tree")
+async def read_geo_tree(request: Request):
+    version = await read_version("geo")
+    headers = {"ETag": f'"geo-{version}"', "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if geo_tree_cache["version"] != version:
+        body = await build_geo_tree()
+        geo_tree_cache.update(version=version, body=body)
+    return Response(geo_tree_cache["body"], media_type="application/json", headers=headers)
 
 # @app.get("/userdetails/{uid}")
 # async def read_user(uid: str):
@@ -515,38 +2395,74 @@ async def read_place(district_id: str):
 
 
 
+# Converts a string id field to an ObjectId inside an aggregation, null if it is not a valid id
+def to_object_id(field: str) -> dict:
+    return {"$convert": {"input": field, "to": "objectId", "onError": None, "onNull": None}}
+
+
+# Resolves user -> place -> district -> state in a single aggregation
+USER_LOCATION_PIPELINE = [
+    {"$lookup": {
+        "from": "place",
+        "let": {"place_id": to_object_id("$place_id")},
+        "pipeline": [
+            {"$match": {"$expr": {"$eq": ["$_id", "$$place_id"]}}},
+            {"$lookup": {
+                "from": "district",
+                "let": {"district_id": to_object_id("$district_id")},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$_id", "$$district_id"]}}},
+                    {"$lookup": {
+                        "from": "state",
+                        "let": {"state_id": to_object_id("$state_id")},
+                        "pipeline": [
+                            {"$match": {"$expr": {"$eq": ["$_id", "$$state_id"]}}},
+                            {"$project": {"_id": 0, "state_name": {"$ifNull": ["$state_name", ""]}}},
+                        ],
+                        "as": "state",
+                    }},
+                    {"$project": {
+                        "_id": 0,
+                        "district_name": {"$ifNull": ["$district_name", ""]},
+                        "state_name": {"$arrayElemAt": ["$state.state_name", 0]},
+                    }},
+                ],
+                "as": "district",
+            }},
+            {"$project": {
+                "_id": 0,
+                "place_name": {"$ifNull": ["$place_name", ""]},
+                "district_name": {"$arrayElemAt": ["$district.district_name", 0]},
+                "state_name": {"$arrayElemAt": ["$district.state_name", 0]},
+            }},
+        ],
+        "as": "location",
+    }},
+    {"$addFields": {
+        "place_name": {"$arrayElemAt": ["$location.place_name", 0]},
+        "district_name": {"$arrayElemAt": ["$location.district_name", 0]},
+        "state_name": {"$arrayElemAt": ["$location.state_name", 0]},
+    }},
+    {"$project": {"location": 0}},
+]
+
+
 @app.get("/userdetails/{uid}")
 async def read_user(uid: str):
     try:
-        user = await app.state.db["user"].find_one({"_id": ObjectId(uid)})
-        if not user:
+        pipeline = [
+            {"$match": {"_id": ObjectId(uid)}},
+            {"$limit": 1},
+            {"$project": projection(hidden=HIDDEN_FIELDS["user"])},
+            *USER_LOCATION_PIPELINE,
+        ]
+        users = await app.state.db["user"].aggregate(pipeline).to_list(1)
+        if not users:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user["_id"] = str(user["_id"])  # Convert _id to string
-
-        # Fetch place details if available
-        place_id = user.get("place_id")
-        if place_id:
-            place = await app.state.db["place"].find_one({"_id": ObjectId(place_id)})
-            if place:
-                user["place_name"] = place.get("place_name", "")
-                district_id = place["district_id"]
-
-#         # Fetch district details if available
-#         district_id = user.get("district_id")
-        if district_id:
-            district = await app.state.db["district"].find_one({"_id": ObjectId(district_id)})
-            if district:
-                user["district_name"] = district.get("district_name", "")
-                state_id=district["state_id"]
-#         # Fetch state details if available
-#         state_id = user.get("state_id")
-        if state_id:
-            state = await app.state.db["state"].find_one({"_id": ObjectId(state_id)})
-            if state:
-                user["state_name"] = state.get("state_name", "")
-
-        return user
+        return MongoJSONResponse(users[0])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid UID format or database error")
 
@@ -559,7 +2475,7 @@ async def change_password(
     currentpassword: str = Form(...)
 ):
     try:
-        user = await app.state.db["user"].find_one({"_id": ObjectId(uid)})
+        user = await fetch_by_id("user", uid, fields=("user_password",))
 
 
         if not user:
@@ -587,11 +2503,10 @@ async def change_password(
 @app.get("/username/{uid}")
 async def read_user(uid: str):
     try:
-        user = await app.state.db["user"].find_one({"_id": ObjectId(uid)})
+        user = await fetch_by_id("user", uid, fields=("user_name",))
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user["_id"] = str(user["_id"])  # Convert _id to string
         return {"user_name": user.get("user_name", "")}
 
     except Exception as e:
@@ -602,12 +2517,11 @@ async def read_user(uid: str):
 @app.get("/useremail/{uid}")
 async def read_user(uid: str):
     try:
-        user = await app.state.db["user"].find_one({"_id": ObjectId(uid)})
+        user = await fetch_by_id("user", uid, fields=("user_email",))
         
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user["_id"] = str(user["_id"]),
         return {"user_email": user.get("user_email", "")}
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid UID format or database error")
@@ -615,12 +2529,11 @@ async def read_user(uid: str):
 @app.get("/hotelemail/{hid}")
 async def read_hotel(hid: str):
     try:
-        hotel = await app.state.db["hotel"].find_one({"_id": ObjectId(hid)})
+        hotel = await fetch_by_id("hotel", hid, fields=("hotel_email",))
         
         if not hotel:
             raise HTTPException(status_code=404, detail="hotel not found")
 
-        hotel["_id"] = str(hotel["_id"]),
         return {"hotel_email": hotel.get("hotel_email", "")}
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid UID format or database error")
@@ -645,6 +2558,7 @@ async def reg_hotel(
     try:
         # Save the file
         saved_filename = await save_file(photo, UPLOAD_DIR)
+        await schedule_thumbnails(saved_filename)
         file_url = f"http://127.0.0.1:8000/{saved_filename}"
         
         saved_id = await save_file(idproof, UPLOAD_DIR)
@@ -657,6 +2571,8 @@ async def reg_hotel(
         
         hotel_data = {"hotel_name": name,"hotel_address": address,"hotel_email":email, "hotel_proof":id_url,"place_id":place,"hotel_password":password,"hotel_status":"pending","hotel_photo":file_url}
         result = await app.state.db["hotel"].insert_one(hotel_data)
+        await bump_stats({"hotels": 1, "pending_hotels": 1}, {"hotels": 1})
+        await bump_version(f"hotel:{result.inserted_id}")
         # result = await app.state.db["user"].update_one({"_id": ObjectId(uid)}, {"$set": user_data})
         
     #     return {
@@ -722,10 +2638,11 @@ async def add_package(
     packageName: str = Form(...),
     packageDescription: str = Form(...),
     duration: str = Form(...),
-    packagePrice: str = Form(...)
+    packagePrice: float = Form(..., ge=0, allow_inf_nan=False)
 ):
     # Save the uploaded image
     saved_filename = await save_file(packageImage, UPLOAD_DIR)
+    await schedule_thumbnails(saved_filename)
     file_url = f"http://127.0.0.1:8000/{saved_filename}"
 
     # Save Package to MongoDB
@@ -734,12 +2651,15 @@ async def add_package(
         "package_name": packageName,
         "package_description": packageDescription,
         "package_duration": duration,
-        "package_price": packagePrice,
+        "package_days": duration_days(duration),
+        "package_price": int(packagePrice) if packagePrice.is_integer() else packagePrice,
         "package_image": file_url,  # Store path for retrieval
     }
 
     # result = await package_collection.insert_one(package_data)
     result = await app.state.db["package"].insert_one(package_data)
+    await refresh_package_card(package_data)
+    await bump_version(f"packages:{hid}", "package_view")
     
     return {"message": "Package added successfully", "package_id": str(result.inserted_id)}
 
@@ -766,19 +2686,95 @@ async def add_package(
 #         raise HTTPException(status_code=400, detail="Invalid UID format or database error")
 
 
+@app.get("/packages/search")
+async def search_packages(
+    q: str = None,
+    min_price: float = None,
+    max_price: float = None,
+    min_days: int = None,
+    max_days: int = None,
+    hotel_id: str = None,
+    place_id: str = None,
+    sort: str = Query("relevance", pattern="^(relevance|price_asc|price_desc)$"),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    skip: int = Query(0, ge=0, le=10000),
+):
+    match = {}
+    if q:
+        match["$text"] = {"$search": q}
+    if min_price is not None or max_price is not None:
+        match["package_price"] = {}
+        if min_price is not None:
+            match["package_price"]["$gte"] = min_price
+        if max_price is not None:
+            match["package_price"]["$lte"] = max_price
+    if min_days is not None or max_days is not None:
+        match["package_days"] = {}
+        if min_days is not None:
+            match["package_days"]["$gte"] = min_days
+        if max_days is not None:
+            match["package_days"]["$lte"] = max_days
+    if place_id:
+        hotels = await app.state.db["hotel"].find({"place_id": place_id}, {"_id": 1}).to_list(length=None)
+        hotel_ids = [str(hotel["_id"]) for hotel in hotels]
+        match["hotel_id"] = {"$in": [hid for hid in hotel_ids if not hotel_id or hid == hotel_id]}
+    elif hotel_id:
+        match["hotel_id"] = hotel_id
+
+    pipeline = [{"$match": match}]
+    if q:
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    if sort == "price_asc":
+        order = {"package_price": 1, "_id": 1}
+    elif sort == "price_desc":
+        order = {"package_price": -1, "_id": 1}
+    elif q:
+        order = {"score": -1, "_id": 1}
+    else:
+        order = {"_id": -1}  # Newest first when there is nothing to rank on
+    pipeline.append({"$facet": {
+        "results": [{"$sort": order}, {"$skip": skip}, {"$limit": limit}],
+        "total": [{"$count": "count"}],
+        "price": [{"$bucket": {
+            "groupBy": "$package_price",
+            # $bucket upper bounds are exclusive; the infinite sentinel gives the last lower bound an
+            # open-ended bucket, so "other" only collects non-numeric prices
+            "boundaries": [*PRICE_BUCKETS, float("inf")],
+            "default": "other",
+            "output": {"count": {"$sum": 1}},
+        }}],
+        "days": [{"$group": {"_id": "$package_days", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}],
+    }})
+
+    try:
+        result = (await app.state.db["package"].aggregate(pipeline).to_list(1))[0]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return MongoJSONResponse({
+        "results": result["results"],
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "facets": {
+            "price": [{"from": bucket["_id"], "count": bucket["count"]} for bucket in result["price"]],
+            "days": [{"days": bucket["_id"], "count": bucket["count"]} for bucket in result["days"]],
+        },
+    })
+
+
 @app.get("/packages/{hid}")
-async def read_packages_by_hid(hid: str):
+async def read_packages_by_hid(
+    hid: str,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+):
     try:
-        packages = await app.state.db["package"].find({"hotel_id": hid}).to_list(100)
+        packages, next_cursor = await find_page("package_view", {"hotel_id": hid}, limit, cursor)
 
         if not packages:
             raise HTTPException(status_code=404, detail=f"No packages found for hotel ID {hid}")
 
-        # Convert ObjectId to string
-        for package in packages:
-            package["_id"] = str(package["_id"])
-
-        return packages
+        return page_response(packages, next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
@@ -786,26 +2782,29 @@ async def read_packages_by_hid(hid: str):
     
 @app.delete("/deletepkg/{package_id}")
 async def delete_item(package_id: str):
-    result = await app.state.db["package"].delete_one({"_id": ObjectId(package_id)})
-    if result.deleted_count == 0:
+    package = await app.state.db["package"].find_one_and_delete({"_id": ObjectId(package_id)}, projection={"hotel_id": 1})
+    await app.state.db["package_view"].delete_one({"_id": ObjectId(package_id)})
+    if not package:
         raise HTTPException(status_code=404, detail="Item not found")
+    await bump_version(f"packages:{package.get('hotel_id')}", "package_view")
     return {"message": "Item deleted successfully"}
 
 
 
 @app.get("/packagelist/")
-async def read_packages():
+async def read_packages(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+):
     try:
-        packages = await app.state.db["package"].find().to_list(100)
+        packages, next_cursor = await find_page("package_view", {}, limit, cursor)
 
         if not packages:
             raise HTTPException(status_code=404, detail=f"No packages found ")
 
-        # Convert ObjectId to string
-        for package in packages:
-            package["_id"] = str(package["_id"])
-
-        return packages
+        return page_response(packages, next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
@@ -831,6 +2830,7 @@ async def add_cotraveller(
 
     # result = await package_collection.insert_one(package_data)
     result = await app.state.db["cotraveller"].insert_one(cotraveller)
+    await bump_version(f"cotravellers:{uid}")
     
     return {"message": "Companion added successfully", "cotraveller_id": str(result.inserted_id)}
 
@@ -838,18 +2838,20 @@ async def add_cotraveller(
 
 
 @app.get("/cotravellerslist/{uid}")
-async def read_cotravellers(uid: str):
+async def read_cotravellers(
+    uid: str,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+):
     try:
-        cotravellers = await app.state.db["cotraveller"].find({"user_id": uid}).to_list(100)
+        cotravellers, next_cursor = await find_page("cotraveller", {"user_id": uid}, limit, cursor)
 
         if not cotravellers:
             raise HTTPException(status_code=404, detail=f"No packages found ")
 
-        # Convert ObjectId to string
-        for cotraveller in cotravellers:
-            cotraveller["_id"] = str(cotraveller["_id"])
-
-        return cotravellers
+        return page_response(cotravellers, next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
@@ -858,27 +2860,29 @@ async def read_cotravellers(uid: str):
         
 @app.delete("/cotravellersdelete/{id}")
 async def delete_item(id: str):
-    result = await app.state.db["cotraveller"].delete_one({"_id": ObjectId(id)})
-    if result.deleted_count == 0:
+    cotraveller = await app.state.db["cotraveller"].find_one_and_delete({"_id": ObjectId(id)}, projection={"user_id": 1})
+    if not cotraveller:
         raise HTTPException(status_code=404, detail="Item not found")
+    await bump_version(f"cotravellers:{cotraveller.get('user_id')}")
     return {"message": "Item deleted successfully"}
 
 
 
 
 @app.get("/pending")
-async def pending():
+async def pending(
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+):
     try:
-        pending = await app.state.db["hotel"].find({"hotel_status": "pending"}).to_list(100)
+        pending, next_cursor = await find_page("hotel", {"hotel_status": "pending"}, limit, cursor, hidden=HIDDEN_FIELDS["hotel"])
 
         if not pending:
             raise HTTPException(status_code=404, detail=f"No packages found ")
 
-        # Convert ObjectId to string
-        for hotel in pending:
-            hotel["_id"] = str(hotel["_id"])
-
-        return hotel
+        return page_response(pending, next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
@@ -893,23 +2897,24 @@ async def change_password(
     action:str,
 ):
     try:
-        hotel = await app.state.db["hotel"].find_one({"_id": ObjectId(hotel_id)})
-
+        # Set the new status and get the previous one in one atomic step
+        hotel = await app.state.db["hotel"].find_one_and_update(
+            {"_id": ObjectId(hotel_id)},
+            {"$set": {"hotel_status": action}},
+            projection={"hotel_status": 1},
+        )
 
         if not hotel:
             raise HTTPException(status_code=404, detail="User not found")
 
-        # Validate the current password
-        if hotel:
-
-        # Update password securely
-             await app.state.db["hotel"].update_one(
-            {"_id": ObjectId(hotel_id)},
-            {"$set": {"hotel_status": action}}
-        )
+        await count_hotel_status_change(hotel.get("hotel_status"), action)
+        await update_package_cards(hotel_id, {"hotel_status": action})
+        await bump_version(f"hotel:{hotel_id}", f"packages:{hotel_id}", "package_view")
 
         return {"message": " updated successfully"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error occurred while updating : {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to update : {str(e)}")
@@ -919,13 +2924,12 @@ async def change_password(
 @app.get("/hoteldetails/{hid}")
 async def read_hotel(hid: str):
     try:
-        hotel = await app.state.db["hotel"].find_one({"_id": ObjectId(hid)})
+        hotel = await fetch_by_id("hotel", hid, hidden=HIDDEN_FIELDS["hotel"])
         
         if not hotel:
             raise HTTPException(status_code=404, detail="hotel not found")
 
-        hotel["_id"] = str(hotel["_id"])
-        return hotel
+        return MongoJSONResponse(hotel)
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid UID format or database error")
     
@@ -952,6 +2956,33 @@ async def update_hotel(
 
     # result = await package_collection.insert_one(package_data)
     result = await app.state.db["hotel"].update_one({"_id": ObjectId(hid)}, {"$set": hotel_data})
+    if result.matched_count:
+        await update_package_cards(hid, {"hotel_name": name})
+        await bump_version(f"hotel:{hid}", f"packages:{hid}", "package_view")
     
-    return {"message": "profile updated successfully", "_id": str(result.inserted_id)}
+    return {"message": "profile updated successfully", "_id": hid}
+
+
+
+# Maintenance commands, e.g. `python main.py rebuild-ratings`, `rebuild-stats` or `rebuild-packages`
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["rebuild-ratings", "rebuild-stats", "rebuild-packages"])
+    args = parser.parse_args()
+
+    async def run_command():
+        mongo_client = AsyncIOMotorClient(MONGO_URI)
+        try:
+            db = mongo_client[DATABASE_NAME]
+            if args.command == "rebuild-ratings":
+                print(f"{await rebuild_rating_summaries(db)} rating summaries rebuilt")
+            elif args.command == "rebuild-stats":
+                print(f"stats rebuilt: {await rebuild_stats(db)}")
+            elif args.command == "rebuild-packages":
+                print(f"{await rebuild_package_view(db)} package cards rebuilt")
+        finally:
+            mongo_client.close()
 
+    asyncio.run(run_command())
@@ -0,0 +1,972 @@
+# In-memory stand-in for the parts of Motor that main.py uses.
+# Collections are dicts keyed by _id; queries, updates and the aggregation stages the
+# routes run are evaluated in Python. Good for demos, tests and benchmarks, not for data
+# that has to survive a restart.
+import asyncio
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+TEXT_SCORE = "__text_score__"  # Carries the $text score of a document through a pipeline
+MISSING = object()
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+# Documents are plain dicts and lists, so a recursive copy is enough and much cheaper than deepcopy
+def clone(value):
+    if isinstance(value, dict):
+        return {key: clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [clone(item) for item in value]
+    return value
+
+
+# ---- values and comparison ----
+
+def get_path(doc, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit():
+            value = value[int(part)] if int(part) < len(value) else MISSING
+        elif isinstance(value, list):
+            values = [get_path(item, part) for item in value if isinstance(item, dict)]
+            value = [item for item in values if item is not MISSING] or MISSING
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def set_path(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+# BSON comparison order between types
+def type_rank(value) -> int:
+    if value is MISSING or value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value):
+    rank = type_rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank == 4:
+        return (rank, tuple((key, sort_key(item)) for key, item in value.items()))
+    if rank == 5:
+        return (rank, tuple(sort_key(item) for item in value))
+    if rank == 9 and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (rank, value)
+
+
+def compare(a, b) -> int:
+    a, b = sort_key(a), sort_key(b)
+    return (a > b) - (a < b)
+
+
+BSON_TYPES = {
+    "double": lambda v: isinstance(v, float),
+    "string": lambda v: isinstance(v, str),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "objectId": lambda v: isinstance(v, ObjectId),
+    "bool": lambda v: isinstance(v, bool),
+    "date": lambda v: isinstance(v, datetime),
+    "null": lambda v: v is None,
+    "int": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "long": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+}
+
+
+# ---- query matching ----
+
+def candidates(value):
+    # A condition on an array field matches the array itself or any of its elements
+    if isinstance(value, list):
+        return [value, *value]
+    return [value]
+
+
+def match_operator(op: str, value, arg) -> bool:
+    if op == "$eq":
+        return any(compare(item, arg) == 0 and type_rank(item) == type_rank(arg) for item in candidates(value)) \
+            or (arg is None and value is MISSING)
+    if op == "$ne":
+        return not match_operator("$eq", value, arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        for item in candidates(value):
+            if item is MISSING or type_rank(item) != type_rank(arg):
+                continue
+            result = compare(item, arg)
+            if {"$gt": result > 0, "$gte": result >= 0, "$lt": result < 0, "$lte": result <= 0}[op]:
+                return True
+        return False
+    if op == "$in":
+        return any(match_value(value, item) for item in arg)
+    if op == "$nin":
+        return not any(match_value(value, item) for item in arg)
+    if op == "$exists":
+        return (value is not MISSING) == bool(arg)
+    if op == "$type":
+        names = arg if isinstance(arg, list) else [arg]
+        return value is not MISSING and any(BSON_TYPES[name](item) for name in names for item in candidates(value))
+    if op == "$regex":
+        pattern = arg if isinstance(arg, re.Pattern) else re.compile(arg)
+        return any(isinstance(item, str) and pattern.search(item) for item in candidates(value))
+    if op == "$not":
+        return not match_value(value, arg)
+    if op == "$size":
+        return isinstance(value, list) and len(value) == arg
+    if op == "$options":
+        return True
+    raise OperationFailure(f"Unsupported query operator {op}")
+
+
+def match_value(value, condition) -> bool:
+    if isinstance(condition, re.Pattern):
+        return match_operator("$regex", value, condition)
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        if "$regex" in condition and "$options" in condition:
+            flags = re.IGNORECASE if "i" in condition["$options"] else 0
+            condition = {**condition, "$regex": re.compile(condition["$regex"], flags)}
+        return all(match_operator(op, value, arg) for op, arg in condition.items())
+    return match_operator("$eq", value, condition)
+
+
+def matches(doc: dict, query: dict, variables: dict = None) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, sub, variables) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub, variables) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub, variables) for sub in condition):
+                return False
+        elif key == "$expr":
+            if not truthy(evaluate(condition, doc, variables or {})):
+                return False
+        elif key == "$text":
+            continue  # Applied by the collection, which knows the text index
+        elif not match_value(get_path(doc, key), condition):
+            return False
+    return True
+
+
+# ---- aggregation expressions ----
+
+def truthy(value) -> bool:
+    return value not in (None, False, 0, MISSING)
+
+
+def convert(value, to: str):
+    if value is None or value is MISSING:
+        return None
+    if to == "objectId":
+        return value if isinstance(value, ObjectId) else ObjectId(value)
+    if to == "string":
+        return value.isoformat() if isinstance(value, datetime) else str(value)
+    if to in ("int", "long"):
+        if isinstance(value, str):
+            return int(value.strip())
+        return int(value)
+    if to in ("double", "decimal"):
+        return float(value.strip() if isinstance(value, str) else value)
+    if to == "bool":
+        return truthy(value)
+    if to == "date":
+        if isinstance(value, ObjectId):
+            return value.generation_time
+        if isinstance(value, str):
+            return datetime.fromisoformat(value)
+        return value
+    raise OperationFailure(f"Unsupported $convert target {to}")
+
+
+def evaluate(expr, doc: dict, variables: dict):
+    if isinstance(expr, str):
+        if expr.startswith("$$"):
+            name, _, path = expr[2:].partition(".")
+            root = doc if name in ("ROOT", "CURRENT") else variables.get(name, MISSING)
+            return get_path(root, path) if path and root is not MISSING else root
+        if expr.startswith("$"):
+            return get_path(doc, expr[1:])
+        return expr
+    if isinstance(expr, list):
+        return [evaluate(item, doc, variables) for item in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith("$"):
+        return {key: value for key, value in
+                ((key, evaluate(item, doc, variables)) for key, item in expr.items()) if value is not MISSING}
+
+    op, arg = next(iter(expr.items()))
+
+    def value(item):
+        return evaluate(item, doc, variables)
+
+    def args():
+        return [value(item) for item in (arg if isinstance(arg, list) else [arg])]
+
+    if op == "$literal":
+        return arg
+    if op == "$convert":
+        try:
+            result = convert(value(arg["input"]), arg["to"])
+        except Exception:
+            if "onError" not in arg:
+                raise OperationFailure("Conversion failed")
+            return value(arg["onError"])
+        if result is None and "onNull" in arg:
+            return value(arg["onNull"])
+        return result
+    conversions = {"$toObjectId": "objectId", "$toString": "string", "$toInt": "int", "$toLong": "long",
+                   "$toDouble": "double", "$toDate": "date", "$toBool": "bool"}
+    if op in conversions:
+        return convert(args()[0], conversions[op])
+    if op == "$ifNull":
+        values = args()
+        return next((item for item in values[:-1] if item is not None and item is not MISSING), values[-1])
+    if op == "$arrayElemAt":
+        array, index = args()
+        if not isinstance(array, list) or not -len(array) <= index < len(array):
+            return MISSING
+        return array[index]
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        left, right = args()
+        result = compare(left, right)
+        return {"$eq": result == 0, "$ne": result != 0, "$gt": result > 0, "$gte": result >= 0,
+                "$lt": result < 0, "$lte": result <= 0}[op]
+    if op == "$and":
+        return all(truthy(item) for item in args())
+    if op == "$or":
+        return any(truthy(item) for item in args())
+    if op == "$not":
+        return not truthy(args()[0])
+    if op == "$in":
+        item, array = args()
+        return any(compare(item, element) == 0 for element in array or [])
+    if op == "$cond":
+        if isinstance(arg, dict):
+            condition, then, otherwise = arg["if"], arg["then"], arg["else"]
+        else:
+            condition, then, otherwise = arg
+        return value(then) if truthy(value(condition)) else value(otherwise)
+    if op == "$let":
+        scope = {**variables, **{name: value(item) for name, item in arg["vars"].items()}}
+        return evaluate(arg["in"], doc, scope)
+    if op == "$trim":
+        text = value(arg["input"])
+        return text.strip() if isinstance(text, str) else None
+    if op == "$regexFind":
+        text = value(arg["input"])
+        if not isinstance(text, str):
+            return None
+        found = re.search(arg["regex"], text, re.IGNORECASE if "i" in arg.get("options", "") else 0)
+        return {"match": found.group(), "idx": found.start(), "captures": list(found.groups())} if found else None
+    if op == "$trunc":
+        number = args()[0]
+        return number if number is None or isinstance(number, int) else float(int(number))
+    if op in ("$add", "$sum"):
+        values = args()
+        if op == "$sum" and len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        return sum(item for item in values if isinstance(item, (int, float)) and not isinstance(item, bool))
+    if op == "$subtract":
+        left, right = args()
+        return left - right
+    if op == "$multiply":
+        result = 1
+        for item in args():
+            result *= item
+        return result
+    if op == "$divide":
+        left, right = args()
+        return left / right
+    if op == "$size":
+        return len(args()[0])
+    if op == "$concat":
+        values = args()
+        return None if any(item is None for item in values) else "".join(values)
+    if op == "$dateToString":
+        date = value(arg["date"])
+        return date.strftime(arg.get("format", "%Y-%m-%dT%H:%M:%S.%LZ").replace("%L", "000"))
+    if op == "$meta":
+        return doc.get(TEXT_SCORE, 0.0)
+    raise OperationFailure(f"Unsupported expression operator {op}")
+
+
+# ---- projections and updates ----
+
+def project(doc: dict, projection, variables=None, expressions=False) -> dict:
+    if not projection:
+        return doc
+    include_id = projection.get("_id", 1) not in (0, False)
+    fields = {key: spec for key, spec in projection.items() if key != "_id"}
+    inclusive = any(spec not in (0, False) for spec in fields.values()) or (not fields and include_id)
+    if inclusive:
+        result = {}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for key, spec in fields.items():
+            if spec in (1, True) or not expressions:
+                found = get_path(doc, key)
+                if found is not MISSING:
+                    set_path(result, key, found)
+            else:
+                found = evaluate(spec, doc, variables or {})
+                if found is not MISSING:
+                    set_path(result, key, found)
+        if TEXT_SCORE in doc:
+            result[TEXT_SCORE] = doc[TEXT_SCORE]
+        return result
+    result = clone(doc)
+    for key in fields:
+        unset_path(result, key)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def apply_update(doc: dict, update, inserting: bool):
+    if isinstance(update, list):  # Update with an aggregation pipeline
+        for stage in update:
+            (name, spec), = stage.items()
+            if name in ("$set", "$addFields"):
+                for key, expr in spec.items():
+                    found = evaluate(expr, doc, {})
+                    if found is not MISSING:
+                        set_path(doc, key, found)
+            elif name == "$unset":
+                for key in ([spec] if isinstance(spec, str) else spec):
+                    unset_path(doc, key)
+            else:
+                raise OperationFailure(f"Unsupported update stage {name}")
+        return
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for key, value in fields.items():
+                set_path(doc, key, clone(value))
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$inc":
+            for key, amount in fields.items():
+                current = get_path(doc, key)
+                set_path(doc, key, (0 if current is MISSING else current) + amount)
+        elif op == "$unset":
+            for key in fields:
+                unset_path(doc, key)
+        elif op == "$push":
+            for key, value in fields.items():
+                current = get_path(doc, key)
+                set_path(doc, key, ([] if current is MISSING else current) + [clone(value)])
+        elif op == "$pull":
+            for key, condition in fields.items():
+                current = get_path(doc, key)
+                if isinstance(current, list):
+                    set_path(doc, key, [item for item in current if not match_value(item, condition)])
+        else:
+            raise OperationFailure(f"Unsupported update operator {op}")
+
+
+def upsert_seed(query: dict) -> dict:
+    # The equality parts of the filter become fields of the inserted document
+    doc = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            if "$eq" in condition:
+                set_path(doc, key, clone(condition["$eq"]))
+            continue
+        set_path(doc, key, clone(condition))
+    return doc
+
+
+# ---- cursors ----
+
+class MemoryCursor:
+    def __init__(self, load, transform=None):
+        self._load = load  # Produces the documents when the cursor is first read
+        self._transform = transform  # Applied after sort/skip/limit, e.g. the projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+        self._docs = None
+        self._position = 0
+
+    def sort(self, key, direction=1):
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _materialize(self) -> list:
+        if self._docs is None:
+            docs = self._load()
+            if self._sort:
+                docs = sort_docs(docs, self._sort)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            if self._transform:
+                docs = [self._transform(doc) for doc in docs]
+            self._docs = docs
+        return self._docs
+
+    async def to_list(self, length=None):
+        docs = self._materialize()
+        end = len(docs) if length is None else min(len(docs), self._position + length)
+        result = docs[self._position:end]
+        self._position = end
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        docs = self._materialize()
+        if self._position >= len(docs):
+            raise StopAsyncIteration
+        self._position += 1
+        if self._position % 100 == 0:
+            await asyncio.sleep(0)  # Let other requests run while a big cursor is streamed
+        return docs[self._position - 1]
+
+
+def sort_docs(docs: list, spec) -> list:
+    for key, direction in reversed(list(spec.items() if isinstance(spec, dict) else spec)):
+        if isinstance(direction, dict):  # {"$meta": "textScore"}
+            docs = sorted(docs, key=lambda doc: doc.get(TEXT_SCORE, 0.0), reverse=True)
+        else:
+            docs = sorted(docs, key=lambda doc: sort_key(get_path(doc, key)), reverse=direction < 0)
+    return docs
+
+
+# ---- collections ----
+
+# Keys a document is filed under in a secondary index; arrays are multikey like in MongoDB
+def index_keys(value) -> list:
+    keys = []
+    for item in (value if isinstance(value, list) else [value]):
+        item = None if item is MISSING else item
+        try:
+            hash(item)
+        except TypeError:
+            continue  # Embedded documents are never looked up by equality here
+        keys.append((type_rank(item), item))
+    return keys
+
+
+# The equality conditions of a query an index can answer, as field -> candidate values
+def equality_conditions(query: dict) -> dict:
+    conditions = {}
+    for field, condition in (query or {}).items():
+        if field.startswith("$"):
+            continue
+        if isinstance(condition, dict) and set(condition) == {"$eq"}:
+            condition = condition["$eq"]
+        if isinstance(condition, dict) and set(condition) == {"$in"}:
+            values = list(condition["$in"])
+        elif isinstance(condition, (dict, list, re.Pattern)):
+            continue
+        else:
+            values = [condition]
+        if all(not isinstance(value, (dict, list, re.Pattern)) for value in values):
+            conditions[field] = values
+    return conditions
+
+
+class MemoryCollection:
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self.docs = OrderedDict()  # _id -> document
+        self.indexes = {"_id_": {"key": [("_id", 1)], "ops": 0, "since": datetime.now(timezone.utc)}}
+        self.lookups = {}  # Leading field of each secondary index -> {(type rank, value): {_id: None}}
+
+    # -- secondary indexes --
+
+    def _index(self, doc: dict):
+        for field, lookup in self.lookups.items():
+            for key in index_keys(get_path(doc, field)):
+                lookup.setdefault(key, {})[doc["_id"]] = None
+
+    def _unindex(self, doc: dict):
+        for field, lookup in self.lookups.items():
+            for key in index_keys(get_path(doc, field)):
+                bucket = lookup.get(key)
+                if bucket is not None:
+                    bucket.pop(doc["_id"], None)
+                    if not bucket:
+                        del lookup[key]
+
+    def _candidate_ids(self, query: dict):
+        # The _ids an index narrows the query down to, or None when it needs a full scan
+        conditions = equality_conditions(query)
+        if "_id" in conditions:
+            return dict.fromkeys(conditions["_id"])
+        field = next((field for field in conditions if field in self.lookups), None)
+        if field is not None:
+            ids = {}
+            for value in conditions[field]:
+                ids.update(self.lookups[field].get((type_rank(value), value), {}))
+            for index in self.indexes.values():
+                if index["key"][0][0] == field:
+                    index["ops"] += 1
+                    break
+            return ids
+        if query.get("$or"):
+            # Like MongoDB, an $or can use indexes only when every branch can
+            ids = {}
+            for branch in query["$or"]:
+                branch_ids = self._candidate_ids(branch)
+                if branch_ids is None:
+                    return None
+                ids.update(branch_ids)
+            return ids
+        return None
+
+    def _candidates(self, query: dict):
+        ids = self._candidate_ids(query)
+        if ids is None:
+            return self.docs.values()
+        return [self.docs[_id] for _id in ids if _id in self.docs]
+
+    def _modify(self, _id, change):
+        doc = self.docs[_id]
+        self._unindex(doc)
+        try:
+            change(doc)
+        finally:
+            self._index(self.docs[_id])
+
+    # -- reads --
+
+    def _text_fields(self) -> dict:
+        for index in self.indexes.values():
+            weights = {field: index.get("weights", {}).get(field, 1) for field, kind in index["key"] if kind == "text"}
+            if weights:
+                return weights
+        raise OperationFailure("text index required for $text query")
+
+    def _scan(self, query: dict) -> list:
+        query = query or {}
+        found = [doc for doc in self._candidates(query) if matches(doc, query)]
+        if "$text" not in query:
+            return found
+        terms = [term.lower() for term in re.findall(r"\w+", query["$text"]["$search"])]
+        weights = self._text_fields()
+        scored = []
+        for doc in found:
+            score = 0.0
+            for field, weight in weights.items():
+                words = re.findall(r"\w+", str(doc.get(field, "")).lower())
+                score += weight * sum(words.count(term) for term in terms)
+            if score:
+                scored.append({**doc, TEXT_SCORE: score})
+        return scored
+
+    def _output(self, doc: dict, projection=None) -> dict:
+        doc = clone(project(doc, projection))
+        doc.pop(TEXT_SCORE, None)
+        return doc
+
+    def find(self, filter=None, projection=None, sort=None, limit=0, **kwargs):
+        cursor = MemoryCursor(lambda: self._scan(filter), lambda doc: self._output(doc, projection))
+        if sort:
+            cursor.sort(sort)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        docs = await self.find(filter, projection, **kwargs).to_list(1)
+        return docs[0] if docs else None
+
+    async def count_documents(self, filter=None, **kwargs) -> int:
+        return len(self._scan(filter))
+
+    # -- writes --
+
+    def _insert(self, doc: dict) -> ObjectId:
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()  # Motor also adds the _id to the caller's document
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} _id: {doc['_id']}")
+        self.docs[doc["_id"]] = clone(doc)
+        self._index(self.docs[doc["_id"]])
+        return doc["_id"]
+
+    async def insert_one(self, document: dict, **kwargs):
+        return Result(inserted_id=self._insert(document), acknowledged=True)
+
+    async def insert_many(self, documents, ordered: bool = True, **kwargs):
+        inserted, errors = [], []
+        for index, doc in enumerate(documents):
+            try:
+                inserted.append(self._insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return Result(inserted_ids=inserted, acknowledged=True)
+
+    def _update(self, query, update, upsert: bool, many: bool):
+        matched = [doc for doc in self._scan(query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            self._modify(doc["_id"], lambda stored: apply_update(stored, update, inserting=False))
+        if matched or not upsert:
+            return Result(matched_count=len(matched), modified_count=len(matched), upserted_id=None)
+        doc = upsert_seed(query)
+        apply_update(doc, update, inserting=True)
+        return Result(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+
+    async def update_one(self, filter, update, upsert: bool = False, **kwargs):
+        return self._update(filter, update, upsert, many=False)
+
+    async def update_many(self, filter, update, upsert: bool = False, **kwargs):
+        return self._update(filter, update, upsert, many=True)
+
+    async def replace_one(self, filter, replacement, upsert: bool = False, **kwargs):
+        found = self._scan(filter)[:1]
+        if found:
+            self._unindex(found[0])
+            self.docs[found[0]["_id"]] = {"_id": found[0]["_id"], **clone(replacement)}
+            self._index(self.docs[found[0]["_id"]])
+            return Result(matched_count=1, modified_count=1, upserted_id=None)
+        if not upsert:
+            return Result(matched_count=0, modified_count=0, upserted_id=None)
+        doc = {**upsert_seed(filter), **clone(replacement)}
+        return Result(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+
+    async def find_one_and_update(self, filter, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        found = self._scan(filter)
+        found = (sort_docs(found, sort) if sort else found)[:1]
+        if not found:
+            if not upsert:
+                return None
+            result = self._update(filter, update, True, many=False)
+            return self._output(self.docs[result.upserted_id], projection) \
+                if return_document == ReturnDocument.AFTER else None
+        before = self._output(self.docs[found[0]["_id"]], projection)
+        self._modify(found[0]["_id"], lambda stored: apply_update(stored, update, inserting=False))
+        return self._output(self.docs[found[0]["_id"]], projection) if return_document == ReturnDocument.AFTER else before
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        found = self._scan(filter)
+        found = (sort_docs(found, sort) if sort else found)[:1]
+        if not found:
+            return None
+        self._unindex(found[0])
+        return self._output(self.docs.pop(found[0]["_id"]), projection)
+
+    async def delete_one(self, filter, **kwargs):
+        found = self._scan(filter)[:1]
+        for doc in found:
+            self._unindex(doc)
+            del self.docs[doc["_id"]]
+        return Result(deleted_count=len(found))
+
+    async def delete_many(self, filter, **kwargs):
+        found = self._scan(filter)
+        for doc in found:
+            self._unindex(doc)
+            del self.docs[doc["_id"]]
+        return Result(deleted_count=len(found))
+
+    async def bulk_write(self, requests, ordered: bool = True, **kwargs):
+        errors = []
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                elif isinstance(request, UpdateOne):
+                    self._update(request._filter, request._doc, bool(request._upsert), many=False)
+                elif isinstance(request, ReplaceOne):
+                    await self.replace_one(request._filter, request._doc, upsert=bool(request._upsert))
+                else:
+                    raise OperationFailure(f"Unsupported bulk operation {type(request).__name__}")
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return Result(acknowledged=True)
+
+    # -- indexes --
+
+    async def create_indexes(self, indexes, **kwargs):
+        names = []
+        for model in indexes:
+            spec = model.document
+            self.indexes.setdefault(spec["name"], {
+                "key": list(spec["key"].items()),
+                "weights": dict(spec.get("weights", {})),
+                "ops": 0,
+                "since": datetime.now(timezone.utc),
+            })
+            field, kind = next(iter(spec["key"].items()))
+            if kind != "text" and field not in self.lookups:
+                self.lookups[field] = {}
+                for doc in self.docs.values():
+                    for key in index_keys(get_path(doc, field)):
+                        self.lookups[field].setdefault(key, {})[doc["_id"]] = None
+            names.append(spec["name"])
+        return names
+
+    # -- aggregation --
+
+    def aggregate(self, pipeline, **kwargs):
+        return MemoryCursor(lambda: self.database.run_pipeline(self, pipeline))
+
+
+# Turns a leading {"$match": {"$expr": {"$eq": ["$field", "$$var"]}}} of a $lookup pipeline into
+# a plain equality so the foreign collection can answer it from an index
+def lookup_hint(pipeline: list, scope: dict) -> dict:
+    if not pipeline or set(pipeline[0]) != {"$match"} or set(pipeline[0]["$match"]) != {"$expr"}:
+        return {}
+    expr = pipeline[0]["$match"]["$expr"]
+    if not isinstance(expr, dict) or set(expr) != {"$eq"} or len(expr["$eq"]) != 2:
+        return {}
+    field, variable = expr["$eq"]
+    if not (isinstance(field, str) and field.startswith("$") and not field.startswith("$$")):
+        field, variable = variable, field
+    if not (isinstance(field, str) and field.startswith("$") and isinstance(variable, str) and variable.startswith("$$")):
+        return {}
+    value = scope.get(variable[2:].split(".")[0], MISSING)
+    if "." in variable or value is None or value is MISSING or isinstance(value, (dict, list)):
+        return {}
+    return {field[1:]: value}
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(self, name)
+        return self.collections[name]
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        return self[name]
+
+    def run_pipeline(self, collection: MemoryCollection, pipeline: list) -> list:
+        first = pipeline[0] if pipeline else {}
+        if "$indexStats" in first:
+            docs = [
+                {"name": name, "key": OrderedDict(index["key"]), "accesses": {"ops": index["ops"], "since": index["since"]}}
+                for name, index in collection.indexes.items()
+            ]
+            pipeline = pipeline[1:]
+        elif "$match" in first:
+            docs = [clone(doc) for doc in collection._scan(first["$match"])]
+            pipeline = pipeline[1:]
+        else:
+            docs = [clone(doc) for doc in collection.docs.values()]
+        return self.run_stage_list(pipeline, docs, {})
+
+    def run_stage(self, name: str, spec, docs: list, variables: dict) -> list:
+        if name == "$match":
+            return [doc for doc in docs if matches(doc, spec, variables)]
+        if name == "$limit":
+            return docs[:spec]
+        if name == "$skip":
+            return docs[spec:]
+        if name == "$sort":
+            return sort_docs(docs, spec)
+        if name == "$project":
+            return [project(doc, spec, variables, expressions=True) for doc in docs]
+        if name in ("$addFields", "$set"):
+            for doc in docs:
+                for key, expr in spec.items():
+                    found = evaluate(expr, doc, variables)
+                    if found is not MISSING:
+                        set_path(doc, key, found)
+                    else:
+                        unset_path(doc, key)
+            return docs
+        if name == "$unset":
+            for doc in docs:
+                for key in ([spec] if isinstance(spec, str) else spec):
+                    unset_path(doc, key)
+            return docs
+        if name == "$count":
+            return [{spec: len(docs)}] if docs else []
+        if name == "$unwind":
+            path, keep_empty = (spec, False) if isinstance(spec, str) else (
+                spec["path"], spec.get("preserveNullAndEmptyArrays", False))
+            result = []
+            for doc in docs:
+                values = get_path(doc, path[1:])
+                if isinstance(values, list) and values:
+                    for item in values:
+                        result.append(dict(doc))
+                        set_path(result[-1], path[1:], item)
+                elif keep_empty:
+                    result.append(doc)
+                    if isinstance(values, list):
+                        unset_path(doc, path[1:])
+            return result
+        if name == "$lookup":
+            foreign = self[spec["from"]]
+            for doc in docs:
+                scope = variables
+                if "localField" in spec:
+                    local = get_path(doc, spec["localField"])
+                    local = candidates(None if local is MISSING else local)
+                    joined = [clone(item) for item in foreign._scan({spec["foreignField"]: {"$in": local}})]
+                else:
+                    scope = {**variables, **{key: evaluate(expr, doc, variables) for key, expr in spec.get("let", {}).items()}}
+                    joined = [clone(item) for item in foreign._scan(lookup_hint(spec.get("pipeline", []), scope))]
+                if "pipeline" in spec:
+                    joined = self.run_stage_list(spec["pipeline"], joined, scope)
+                doc[spec["as"]] = joined
+            return docs
+        if name == "$group":
+            groups = OrderedDict()
+            for doc in docs:
+                key = evaluate(spec["_id"], doc, variables)
+                key = None if key is MISSING else key
+                marker = repr(sort_key(key))
+                if marker not in groups:
+                    groups[marker] = ({"_id": key}, [])
+                groups[marker][1].append(doc)
+            result = []
+            for group, members in groups.values():
+                for field, accumulator in spec.items():
+                    if field != "_id":
+                        group[field] = accumulate(accumulator, members, variables)
+                result.append(group)
+            return result
+        if name == "$bucket":
+            boundaries = spec["boundaries"]
+            buckets = OrderedDict()
+            for doc in docs:
+                found = evaluate(spec["groupBy"], doc, variables)
+                key = MISSING
+                if type_rank(found) == type_rank(boundaries[0]):
+                    for lower, upper in zip(boundaries, boundaries[1:]):
+                        if compare(lower, found) <= 0 < compare(upper, found):
+                            key = lower
+                            break
+                if key is MISSING:
+                    if "default" not in spec:
+                        raise OperationFailure("$bucket value outside of the boundaries and no default")
+                    key = spec["default"]
+                buckets.setdefault(repr(sort_key(key)), (key, []))[1].append(doc)
+            output = spec.get("output", {"count": {"$sum": 1}})
+            ordered = sorted(buckets.values(), key=lambda item: (item[0] == spec.get("default", MISSING), sort_key(item[0])))
+            return [{"_id": key, **{field: accumulate(acc, members, variables) for field, acc in output.items()}}
+                    for key, members in ordered]
+        if name == "$facet":
+            return [{field: self.run_stage_list(sub, [clone(doc) for doc in docs], variables)
+                     for field, sub in spec.items()}]
+        raise OperationFailure(f"Unsupported aggregation stage {name}")
+
+    def run_stage_list(self, pipeline: list, docs: list, variables: dict) -> list:
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            docs = self.run_stage(name, spec, docs, variables)
+        for doc in docs:
+            doc.pop(TEXT_SCORE, None)
+        return docs
+
+
+def accumulate(accumulator: dict, members: list, variables: dict):
+    (op, expr), = accumulator.items()
+    values = [evaluate(expr, doc, variables) for doc in members]
+    values = [value for value in values if value is not MISSING]
+    numbers = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    if op == "$sum":
+        return sum(numbers)
+    if op == "$avg":
+        return sum(numbers) / len(numbers) if numbers else None
+    if op == "$min":
+        return min(values, key=sort_key) if values else None
+    if op == "$max":
+        return max(values, key=sort_key) if values else None
+    if op == "$first":
+        return values[0] if values else None
+    if op == "$last":
+        return values[-1] if values else None
+    if op == "$push":
+        return values
+    if op == "$addToSet":
+        unique = OrderedDict((repr(sort_key(value)), value) for value in values)
+        return list(unique.values())
+    raise OperationFailure(f"Unsupported accumulator {op}")
+
+
+class MemoryClient:
+    def __init__(self, uri: str = None, **kwargs):
+        self.databases = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(name)
+        return self.databases[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,41 @@
+# Conditional GET tests against the in-memory engine (memorydb.py).
+#
+#   python -m pytest tests
+import asyncio
+import os
+import sys
+
+import httpx
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import main  # noqa: E402
+
+main.STORAGE_BACKEND = "memory"
+
+
+async def statuses(make_requests) -> list:
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            return [response.status_code for response in await make_requests(main.app.state.db, client)]
+
+
+def test_unknown_ids_are_not_answered_with_304():
+    async def make_requests(db, client):
+        return [
+            await client.get(url, headers={"If-None-Match": tag})
+            for url in ("/hoteldetails/zzz", f"/userdetails/{ObjectId()}")
+            for tag in ('"v0"', '"v0.0"', "*")
+        ]
+
+    assert 304 not in asyncio.run(statuses(make_requests))
+
+
+def test_resource_without_a_stamp_gets_one_after_its_first_200():
+    async def make_requests(db, client):
+        hotel = await db["hotel"].insert_one({"hotel_name": "H"})  # Created before stamps existed
+        first = await client.get(f"/hoteldetails/{hotel.inserted_id}", headers={"If-None-Match": '"v0"'})
+        second = await client.get(f"/hoteldetails/{hotel.inserted_id}", headers={"If-None-Match": first.headers["ETag"]})
+        return [first, second]
+
+    assert asyncio.run(statuses(make_requests)) == [200, 304]
@@ -0,0 +1,43 @@
+# Rate limit tests against the in-memory engine (memorydb.py).
+#
+#   python -m pytest tests
+import asyncio
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import main  # noqa: E402
+
+main.STORAGE_BACKEND = "memory"
+
+
+async def login_statuses(forwarded_for: list) -> list:
+    statuses = []
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            for value in forwarded_for:
+                response = await client.post(
+                    "/login", json={"email": "a@example.com", "password": "x"}, headers={"X-Forwarded-For": value}
+                )
+                statuses.append(response.status_code)
+    return statuses
+
+
+def test_spoofed_forwarded_for_does_not_reset_the_login_limit(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_TRUST_PROXY", 1)
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(main.RATE_LIMIT_MAX_BUCKETS))
+    burst = main.RATE_LIMIT_POLICIES["login"][0]
+    # The client makes up the leftmost entry on every request; the proxy appends the real address
+    statuses = asyncio.run(login_statuses([f"10.0.0.{i}, 203.0.113.7" for i in range(burst + 1)]))
+    assert 429 not in statuses[:burst]
+    assert statuses[burst] == 429
+
+
+def test_each_client_behind_the_proxy_gets_its_own_bucket(monkeypatch):
+    monkeypatch.setattr(main, "RATE_LIMIT_TRUST_PROXY", 1)
+    monkeypatch.setattr(main, "rate_limiter", main.RateLimiter(main.RATE_LIMIT_MAX_BUCKETS))
+    burst = main.RATE_LIMIT_POLICIES["login"][0]
+    statuses = asyncio.run(login_statuses([f"203.0.113.{i}" for i in range(burst + 1)]))
+    assert 429 not in statuses
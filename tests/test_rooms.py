@@ -0,0 +1,59 @@
+# Room inventory tests against the in-memory engine (memorydb.py).
+#
+#   python -m pytest tests
+import asyncio
+import os
+import sys
+
+import httpx
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import main  # noqa: E402
+
+main.STORAGE_BACKEND = "memory"
+
+BOOKING = {
+    "booking_date": "2026-01-01",
+    "booking_for_date": "2026-03-01",
+    "booking_to_date": "2026-03-02",
+    "booking_status": "booked",
+    "packagehead_id": "p",
+    "user_id": "u",
+    "guide_id": "g",
+    "booking_amount": 1,
+}
+
+
+async def book_after_concurrent_insert(competitor_rooms: int, rooms: int) -> tuple:
+    # Replays the race where another booking inserts the night's room_night row between this
+    # request's upsert finding no match and trying to insert: the server then raises
+    # DuplicateKeyError on the upsert even though the row may still have rooms left.
+    async with main.app.router.lifespan_context(main.app):
+        db = main.app.state.db
+        hotel = await db["hotel"].insert_one({"hotel_name": "H", "hotel_room_count": 2})
+        hotel_id = str(hotel.inserted_id)
+        room_night = db["room_night"]
+        update_one = room_night.update_one
+
+        async def racing_update_one(filter, update, upsert=False, **kwargs):
+            if upsert:
+                await room_night.insert_one(
+                    {"_id": filter["_id"], "hotel_id": hotel_id, "night": "2026-03-01", "booked": competitor_rooms}
+                )
+                raise DuplicateKeyError("E11000 duplicate key error")
+            return await update_one(filter, update, upsert=upsert, **kwargs)
+
+        room_night.update_one = racing_update_one
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            response = await client.post("/booking/", json={**BOOKING, "hotel_id": hotel_id, "booking_room_count": rooms})
+        night = await room_night.find_one({"_id": f"{hotel_id}:2026-03-01"})
+        return response.status_code, night["booked"]
+
+
+def test_booking_that_loses_the_insert_race_takes_the_free_rooms():
+    assert asyncio.run(book_after_concurrent_insert(competitor_rooms=1, rooms=1)) == (200, 2)
+
+
+def test_booking_that_loses_the_insert_race_is_refused_when_full():
+    assert asyncio.run(book_after_concurrent_insert(competitor_rooms=2, rooms=1)) == (409, 2)